@@ -0,0 +1,176 @@
+"""
+Read-only JSON API: product search, product detail and substitutes.
+
+Responses carry an ETag and a Last-Modified built from the catalogue
+version, see openfoodfacts.cache, so clients revalidate with
+If-None-Match or If-Modified-Since and get a 304 until the next import.
+The returned fields can be picked with ?fields=id_product,product_name.
+
+The autocomplete answers from memory, see openfoodfacts.autocomplete.
+"""
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_safe
+
+from . import db
+from .autocomplete import product_names
+from .cache import catalogue_updated_at, catalogue_version
+from .metrics import registry
+from .models import Products
+from .nutrients import LEVELS, NUTRIENTS, level_field
+from .pagination import KeysetPaginator
+from .search import search_products
+from .substitutes import ranked_substitutes
+
+LEVEL_NAMES = dict(LEVELS)
+
+FIELDS = [
+    "id_product",
+    "product_name",
+    "url",
+    "img",
+    "nutriscore",
+    "category",
+] + NUTRIENTS + [level_field(nutrient) for nutrient in NUTRIENTS]
+
+DEFAULT_FIELDS = ["id_product", "product_name", "img", "nutriscore"]
+
+SEARCH_LIMIT = 20
+MAX_LIMIT = 100
+SUBSTITUTES_PER_PAGE = 9
+AUTOCOMPLETE_LIMIT = 10
+
+
+def catalogue_etag(request, *args, **kwargs):
+    return "catalogue-{}".format(catalogue_version(request))
+
+
+def catalogue_last_modified(request, *args, **kwargs):
+    return catalogue_updated_at(request)
+
+
+def api_view(view):
+    """GET and HEAD only, revalidated against the catalogue version."""
+    view = condition(etag_func=catalogue_etag, last_modified_func=catalogue_last_modified)(view)
+    view = cache_control(public=True, no_cache=True)(view)
+    return require_safe(view)
+
+
+def error(message, status=400):
+    return JsonResponse({"error": message}, status=status)
+
+
+def requested_fields(request):
+    """Fields asked with ?fields=, None when one of them is unknown."""
+    fields = request.GET.get("fields")
+    if not fields:
+        return DEFAULT_FIELDS
+    fields = [field.strip() for field in fields.split(",") if field.strip()]
+    if not fields or not set(fields) <= set(FIELDS):
+        return None
+    return fields
+
+
+def with_fields(queryset, fields):
+    if "category" in fields:
+        return queryset.select_related("category")
+    return queryset
+
+
+def serialize(product, fields):
+    data = {}
+    for field in fields:
+        if field == "category":
+            data[field] = product.category.category_name
+        elif field.endswith("_level"):
+            data[field] = LEVEL_NAMES.get(getattr(product, field))
+        else:
+            data[field] = getattr(product, field)
+    return data
+
+
+def fields_error():
+    return error("Unknown field, available fields: {}".format(", ".join(FIELDS)))
+
+
+@api_view
+def products(request):
+    """Products matching ?query=, best match first."""
+    query = request.GET.get("query")
+    if not query:
+        return error("The query parameter is required.")
+    fields = requested_fields(request)
+    if fields is None:
+        return fields_error()
+    try:
+        limit = min(int(request.GET.get("limit", SEARCH_LIMIT)), MAX_LIMIT)
+    except ValueError:
+        return error("limit must be a number.")
+
+    queryset = with_fields(search_products(query), fields)
+    return JsonResponse({
+        "query": query,
+        "products": [serialize(product, fields) for product in queryset[:max(limit, 0)]],
+    })
+
+
+@api_view
+def product(request, id_product):
+    fields = requested_fields(request)
+    if fields is None:
+        return fields_error()
+    try:
+        product = with_fields(Products.objects.all(), fields).get(pk=id_product)
+    except Products.DoesNotExist:
+        return error("Product not found.", status=404)
+    return JsonResponse(serialize(product, fields))
+
+
+@api_view
+def substitutes(request, id_product):
+    """The substitutes of a product, best first, paginated with ?cursor=."""
+    fields = requested_fields(request)
+    if fields is None:
+        return fields_error()
+    if not Products.objects.filter(pk=id_product).exists():
+        return error("Product not found.", status=404)
+
+    paginator = KeysetPaginator(
+        with_fields(ranked_substitutes(id_product), fields),
+        SUBSTITUTES_PER_PAGE,
+        key="rankings__rank",
+        )
+    page = paginator.page(request.GET.get("cursor"))
+    return JsonResponse({
+        "product": id_product,
+        "substitutes": [serialize(product, fields) for product in page],
+        "next": page.next_cursor,
+        "previous": page.previous_cursor,
+    })
+
+
+@require_safe
+@cache_control(public=True, max_age=60)
+def autocomplete(request):
+    """Product names starting with ?q=, served from memory."""
+    try:
+        limit = min(int(request.GET.get("limit", AUTOCOMPLETE_LIMIT)), MAX_LIMIT)
+    except ValueError:
+        return error("limit must be a number.")
+    query = request.GET.get("q", "")
+    return JsonResponse({
+        "q": query,
+        "products": product_names.search(query, max(limit, 0)),
+    })
+
+
+@staff_member_required
+def metrics(request):
+    """
+    Request metrics of this process per view, see openfoodfacts.metrics,
+    and reuse of its database connections, see openfoodfacts.db.
+    """
+    snapshot = registry.snapshot()
+    snapshot['connections'] = db.stats.snapshot()
+    return JsonResponse(snapshot)
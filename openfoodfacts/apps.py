@@ -3,3 +3,20 @@ from django.apps import AppConfig
 
 class OpenfoodfactsConfig(AppConfig):
     name = 'openfoodfacts'
+
+    def ready(self):
+        from django.contrib.auth import get_user_model
+        from django.core.signals import request_finished, request_started
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete, post_save
+
+        from . import db
+        from .backends import evict_user
+
+        post_save.connect(evict_user, sender=get_user_model(), dispatch_uid='evict_user')
+        post_delete.connect(evict_user, sender=get_user_model(), dispatch_uid='evict_user')
+
+        # after Django's close_old_connections, see openfoodfacts.db
+        request_started.connect(db.check_connections, dispatch_uid='check_connections')
+        request_finished.connect(db.mark_used, dispatch_uid='mark_used')
+        connection_created.connect(db.count_connection, dispatch_uid='count_connection')
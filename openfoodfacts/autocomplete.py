@@ -0,0 +1,129 @@
+"""
+In-process prefix index of the product names, for the autocomplete.
+
+Names are accent-folded and lowercased, and every word of a name starts an
+entry of a sorted array, so that "noisette" finds "Pâte de noisettes".
+A lookup is a bisect on that array and never touches the database. The
+index is built at the warm-up of the process, or on the first lookup, and
+rebuilt when the catalogue version changes, which is checked at most every
+AUTOCOMPLETE_REFRESH seconds by a single thread in the background while the
+requests keep using the current index.
+"""
+import bisect
+import logging
+import threading
+import time
+import unicodedata
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from .cache import catalogue_version
+from .models import Products
+
+logger = logging.getLogger(__name__)
+
+REFRESH = getattr(settings, 'AUTOCOMPLETE_REFRESH', 30)
+
+
+def normalize(text):
+    """'Pâte à  tartiner' becomes 'pate a tartiner'."""
+    text = unicodedata.normalize('NFKD', text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(text.casefold().split())
+
+
+class PrefixIndex:
+    """Sorted (key, name, id) entries, one per word of each name."""
+
+    def __init__(self, products):
+        entries = []
+        for id_product, name in products:
+            words = normalize(name).split()
+            for i in range(len(words)):
+                entries.append((" ".join(words[i:]), i, name, id_product))
+        entries.sort()
+        self.keys = [entry[0] for entry in entries]
+        self.entries = entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def search(self, prefix, limit=10):
+        """Products whose name has a word starting with `prefix`."""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        start = bisect.bisect_left(self.keys, prefix)
+        for position in range(start, len(self.entries)):
+            key, _, name, id_product = self.entries[position]
+            if not key.startswith(prefix) or len(results) == limit:
+                break
+            if id_product not in seen:
+                seen.add(id_product)
+                results.append({"id_product": id_product, "product_name": name})
+        return results
+
+
+class Autocomplete:
+    """
+    The PrefixIndex of the current catalogue, shared by the threads.
+    With `background` the version is checked and the index rebuilt in a
+    thread of their own, otherwise by the request which saw it was time.
+    """
+
+    def __init__(self, refresh=REFRESH, background=True):
+        self.refresh = refresh
+        self.background = background
+        self._index = None
+        self._version = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        # held while a check runs
+        self._checking = threading.Lock()
+
+    def index(self):
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._checked_at = time.monotonic()
+                    self._check()
+        elif (time.monotonic() - self._checked_at > self.refresh
+              and self._checking.acquire(blocking=False)):
+            # only this request starts a check, the others keep the current index
+            self._checked_at = time.monotonic()
+            if self.background:
+                threading.Thread(target=self._check_in_background, daemon=True).start()
+            else:
+                try:
+                    self._check()
+                finally:
+                    self._checking.release()
+        return self._index
+
+    def _check_in_background(self):
+        try:
+            self._check()
+        except DatabaseError:
+            logger.warning("Autocomplete index not rebuilt, database unavailable.", exc_info=True)
+        finally:
+            # the connection of this thread is not closed by a request
+            connections.close_all()
+            self._checking.release()
+
+    def _check(self):
+        """Rebuild the index when the catalogue version changed, then swap it in."""
+        version = catalogue_version()
+        if self._index is None or version != self._version:
+            products = Products.objects.values_list('id_product', 'product_name')
+            index = PrefixIndex(products.iterator())
+            self._version = version
+            self._index = index
+
+    def search(self, prefix, limit=10):
+        return self.index().search(prefix, limit)
+
+
+product_names = Autocomplete()
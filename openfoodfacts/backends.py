@@ -0,0 +1,37 @@
+"""
+Authentication backend caching the users of the sessions.
+
+django.contrib.auth loads the user of the session on every request which
+touches request.user. CachedModelBackend keeps the users in the default
+cache for USER_CACHE_TIMEOUT seconds; with the cached_db session engine an
+authenticated request reads its identity without any query. Saving or
+deleting a user evicts it, QuerySet.update() does not.
+
+Evictions only reach the other workers and dynos through a shared cache,
+the settings fall back to ModelBackend otherwise, see SHARED_CACHE_BACKENDS.
+"""
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+USER_CACHE_TIMEOUT = getattr(settings, 'USER_CACHE_TIMEOUT', 60 * 15)
+
+
+def user_key(user_id):
+    return "user-{}".format(user_id)
+
+
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        key = user_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, user, USER_CACHE_TIMEOUT)
+        return user
+
+
+def evict_user(sender, instance, **kwargs):
+    """Signal receiver dropping a saved or deleted user from the cache."""
+    cache.delete(user_key(instance.pk))
@@ -0,0 +1,103 @@
+"""
+Cache of the pages served to anonymous visitors.
+
+The pages only change when the catalogue is imported, so they are cached
+under the current catalogue version. api_off bumps the version at the end
+of an import and the pages of the previous version are never read again,
+whatever the cache backend.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from .models import CatalogueVersion
+
+# Cached pages and fragments expire anyway after this delay, in seconds
+CACHE_TIMEOUT = getattr(settings, 'PURBEURRE_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def catalogue(request=None):
+    """(version, updated_at) of the catalogue, read once per request."""
+    if request is not None and hasattr(request, '_catalogue'):
+        return request._catalogue
+    state = CatalogueVersion.objects.values_list('version', 'updated_at').first()
+    state = state or (0, None)
+    if request is not None:
+        request._catalogue = state
+    return state
+
+
+def catalogue_version(request=None):
+    return catalogue(request)[0]
+
+
+def catalogue_updated_at(request=None):
+    """Time of the last import, None before the first one."""
+    return catalogue(request)[1]
+
+
+def bump_catalogue_version():
+    """Invalidate the cached pages, called once the catalogue changed."""
+    with transaction.atomic():
+        bumped = CatalogueVersion.objects.filter(pk=1).update(
+            version=F('version') + 1
+            )
+        if not bumped:
+            CatalogueVersion.objects.create(pk=1, version=1)
+
+
+def page_key(request):
+    url = hashlib.md5(request.get_full_path().encode('utf-8')).hexdigest()
+    return 'purbeurre.page.{}.{}'.format(catalogue_version(request), url)
+
+
+def cache_anonymous(view):
+    """
+    Serve the GET requests of anonymous visitors without a session from
+    the cache. The responses are stored by AnonymousCacheMiddleware.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if (request.method != 'GET' or not request.session.is_empty()
+                or request.user.is_authenticated):
+            return view(request, *args, **kwargs)
+
+        key = page_key(request)
+        response = cache.get(key)
+        if response is not None:
+            return response
+
+        request._page_key = key
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def reads_session(request):
+    """True when the response was built from the content of a session."""
+    session = getattr(request, 'session', None)
+    return session is not None and session.accessed and not session.is_empty()
+
+
+class AnonymousCacheMiddleware:
+    """
+    Store the responses of the cache_anonymous views once the whole
+    middleware chain ran, so that the cookies and the session reads of the
+    other middlewares are seen. Only successful responses which set no
+    cookie and read no session are stored. Placed first, after the metrics.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        key = getattr(request, '_page_key', None)
+        if (key is not None and response.status_code == 200
+                and not response.streaming and not response.cookies
+                and not reads_session(request)):
+            cache.set(key, response, CACHE_TIMEOUT)
+        return response
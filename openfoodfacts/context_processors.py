@@ -0,0 +1,11 @@
+from django.utils.functional import SimpleLazyObject
+
+from .cache import CACHE_TIMEOUT, catalogue_version
+
+
+def catalogue(request):
+    """Catalogue version and timeout of the cached template fragments."""
+    return {
+        'catalogue_version': SimpleLazyObject(lambda: catalogue_version(request)),
+        'cache_timeout': CACHE_TIMEOUT,
+    }
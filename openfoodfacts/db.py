@@ -0,0 +1,86 @@
+"""
+Persistent database connections.
+
+Connections are kept open CONN_MAX_AGE seconds. Django checks a connection
+only after an error, so a connection dropped while idle, by a database
+restart or a pooler, fails the first query of the next request.
+check_connections pings the reused connections when a request starts, if
+they stayed idle more than DATABASE_HEALTH_CHECK_IDLE seconds, and closes
+the dead ones so that Django opens new ones.
+
+`stats` counts the requests and the connections opened by this process,
+served with the request metrics.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+
+class ConnectionStats:
+    """Requests and opened connections of this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.opened = 0
+            self.unusable = 0
+            self._since = time.time()
+
+    def add(self, requests=0, opened=0, unusable=0):
+        with self._lock:
+            self.requests += requests
+            self.opened += opened
+            self.unusable += unusable
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'since': self._since,
+                'requests': self.requests,
+                'opened': self.opened,
+                'unusable': self.unusable,
+                # share of the requests served without a new connection
+                'reuse_ratio': round(max(0, 1 - self.opened / self.requests), 3)
+                if self.requests else None,
+            }
+
+
+stats = ConnectionStats()
+
+# Alias: monotonic time of the end of the last request, per thread
+_last_used = threading.local()
+
+
+def check_connections(**kwargs):
+    """request_started receiver, closing the dead idle connections."""
+    stats.add(requests=1)
+    idle = getattr(settings, 'DATABASE_HEALTH_CHECK_IDLE', 30)
+    used = getattr(_last_used, 'aliases', {})
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is None or connection.in_atomic_block:
+            continue
+        if connection.alias in used and now - used[connection.alias] < idle:
+            continue
+        if not connection.is_usable():
+            connection.close()
+            stats.add(unusable=1)
+
+
+def mark_used(**kwargs):
+    """request_finished receiver, recording when the connections were used."""
+    _last_used.aliases = {
+        connection.alias: time.monotonic()
+        for connection in connections.all() if connection.connection is not None
+        }
+
+
+def count_connection(sender, connection, **kwargs):
+    """connection_created receiver."""
+    stats.add(opened=1)
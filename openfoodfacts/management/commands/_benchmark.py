@@ -0,0 +1,228 @@
+"""
+Helpers of the benchmark commands: a synthetic catalogue, a synthetic
+OpenFoodFacts dump and the timing of the requests.
+"""
+import gzip
+import json
+import math
+import os
+import random
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from openfoodfacts.models import Categories, Products, Substitutes, User
+from openfoodfacts.nutrients import update_levels
+from openfoodfacts.substitutes import rebuild_substitutes
+
+# Root categories and the kinds of products found below each of them
+CATEGORY_TREE = {
+    "en:spreads": ["hazelnut-spreads", "jams", "honeys", "peanut-butters"],
+    "en:dairies": ["cheeses", "yogurts", "milks", "butters"],
+    "en:snacks": ["biscuits", "chocolates", "crisps", "candies"],
+    "en:beverages": ["sodas", "fruit-juices", "iced-teas", "waters"],
+    "en:breakfasts": ["cereals", "breads", "pastries", "mueslis"],
+}
+
+# Leaf categories below each kind of product, e.g. "en:organic-jams"
+VARIANTS = ["organic", "light", "classic", "filled"]
+
+# Products per leaf category, so that each family, a kind of product and
+# its leaves, stays realistic whatever the size of the catalogue
+PRODUCTS_PER_CATEGORY = 500
+
+BRANDS = ["Bonne Maman", "Lu", "Président", "Danone", "Ferrero", "Lactalis",
+          "Carrefour", "Casino", "Jardin Bio", "St Michel", "Andros", "Milka"]
+
+WORDS = ["noisettes", "chocolat", "fraise", "abricot", "nature", "bio",
+         "allégé", "sucre", "beurre", "lait", "miel", "vanille", "citron",
+         "amandes", "complet", "croustillant", "fondant", "classique"]
+
+NUTRISCORES = ["a"] * 2 + ["b"] * 3 + ["c"] * 4 + ["d"] * 4 + ["e"] * 3
+
+
+def leaf_chains(count):
+    """
+    `count` (root, kind, leaf) category names. Kinds are repeated with a
+    number once each of them has a leaf of every variant.
+    """
+    kinds = [(root, kind) for root, children in CATEGORY_TREE.items() for kind in children]
+    chains = []
+    for i in range(count):
+        root, kind = kinds[i % len(kinds)]
+        serie, variant = divmod(i // len(kinds), len(VARIANTS))
+        suffix = "-{}".format(serie) if serie else ""
+        chains.append((
+            root,
+            "en:{}{}".format(kind, suffix),
+            "en:{}-{}{}".format(VARIANTS[variant], kind, suffix),
+            ))
+    return chains
+
+
+def seed_catalogue(products, seed=0, batch_size=5000, substitutes=True):
+    """
+    Fill an empty database with `products` synthetic products, their
+    categories and, unless `substitutes` is False, their ranked
+    substitutes. Return the product ids.
+    """
+    rand = random.Random(seed)
+
+    nodes = {}
+    leaves = []
+    for chain in leaf_chains(max(1, math.ceil(products / PRODUCTS_PER_CATEGORY))):
+        parent = None
+        for name in chain:
+            if name not in nodes:
+                nodes[name] = Categories.objects.create(category_name=name, parent=parent)
+            parent = nodes[name]
+        leaves.append(parent)
+
+    def decimal(high):
+        return Decimal(rand.uniform(0, high)).quantize(Decimal("0.01"))
+
+    batch = []
+    for i in range(1, products + 1):
+        batch.append(Products(
+            id_product=i,
+            product_name="{} {} {} {}".format(
+                rand.choice(BRANDS), rand.choice(WORDS), rand.choice(WORDS), i
+                ),
+            url="https://fr.openfoodfacts.org/produit/{}".format(i),
+            img="https://static.openfoodfacts.org/images/products/{}.jpg".format(i),
+            nutriscore=rand.choice(NUTRISCORES),
+            fat=decimal(40),
+            saturated_fat=decimal(15),
+            salt=decimal(3),
+            sugar=decimal(60),
+            category=rand.choice(leaves),
+            ))
+        if len(batch) == batch_size:
+            Products.objects.bulk_create(batch)
+            batch = []
+    Products.objects.bulk_create(batch)
+
+    update_levels(Products.objects.all())
+    if substitutes:
+        rebuild_substitutes()
+    return list(range(1, products + 1))
+
+
+def seed_user(product_ids, saved=20, seed=0):
+    """A user with `saved` substitutes, for the saved page."""
+    rand = random.Random(seed)
+    user = User.objects.create_user(username="benchmark", password="benchmark")
+    pairs = set()
+    while len(pairs) < min(saved, len(product_ids) - 1):
+        origin, replacement = rand.sample(product_ids, 2)
+        pairs.add((origin, replacement))
+    Substitutes.objects.bulk_create(
+        Substitutes(origin_id=origin, replacement_id=replacement, user=user)
+        for origin, replacement in pairs
+        )
+    return user
+
+
+# Product replayed by benchmark_import, in the format of the extracted products
+FIXTURE = os.path.join(
+    os.path.dirname(__file__), os.pardir, os.pardir, "tests", "mock_folder", "off.json"
+    )
+
+
+def write_dump(path, products, seed=0):
+    """
+    Write a gzipped OpenFoodFacts JSONL dump of `products` products, copies
+    of the fixture product with their own id, name, nutriscore, nutriments
+    and categories.
+    """
+    rand = random.Random(seed)
+    with open(FIXTURE) as fixture:
+        template = json.load(fixture)[0]
+    leaves = leaf_chains(max(1, math.ceil(products / PRODUCTS_PER_CATEGORY)))
+
+    with gzip.open(path, "wt", encoding="utf-8") as dump:
+        for i in range(1, products + 1):
+            chain = rand.choice(leaves)
+            product = {
+                "_id": str(template["product_id"] + i),
+                "product_name": "{} {} {}".format(template["product_name"], rand.choice(WORDS), i),
+                "url": template["product_url"],
+                "image_small_url": template["product_img"],
+                "nutrition_grades_tags": [rand.choice(NUTRISCORES)],
+                "nutriments": {
+                    "fat_100g": round(rand.uniform(0, 40), 2),
+                    "saturated-fat_100g": round(rand.uniform(0, 15), 2),
+                    "salt_100g": round(rand.uniform(0, 3), 2),
+                    "sugars_100g": round(rand.uniform(0, 60), 2),
+                },
+                "categories_prev_hierarchy": list(chain),
+                "last_modified_t": 1500000000 + i,
+            }
+            dump.write(json.dumps(product) + "\n")
+    return path
+
+
+def git_commit():
+    """Short hash of the checked out commit, None outside of git."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL
+            ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(values)))
+    return values[rank - 1]
+
+
+def timed_get(get, path):
+    """Latency of a request in milliseconds."""
+    start = time.perf_counter()
+    response = get(path)
+    latency = (time.perf_counter() - start) * 1000
+    if response.status_code >= 500:
+        raise RuntimeError("{} answered {}".format(path, response.status_code))
+    return latency
+
+
+def measure(get, paths, count_queries=True, concurrency=1):
+    """
+    Request each path with `get` and return the timing statistics, in
+    milliseconds. Queries are counted when requests run in this process,
+    one at a time. With a `concurrency` above 1, `get` is called by that
+    many threads and must be thread safe.
+    """
+    queries = []
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = list(executor.map(lambda path: timed_get(get, path), paths))
+        count_queries = False
+    else:
+        latencies = []
+        for path in paths:
+            with CaptureQueriesContext(connection) as captured:
+                latencies.append(timed_get(get, path))
+            queries.append(len(captured))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": len(paths),
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "queries": round(sum(queries) / len(queries), 2) if count_queries else None,
+        "throughput_rps": round(len(paths) / elapsed, 1),
+    }
@@ -0,0 +1,449 @@
+import gzip
+import hashlib
+import json
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from decimal import Decimal, InvalidOperation
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from django.db import connection, transaction, DataError, IntegrityError
+
+from openfoodfacts.models import Categories, Products
+from openfoodfacts.nutrients import NUTRIENTS, level_field, nutrient_level
+
+logger = logging.getLogger(__name__)
+
+
+# Product fields written by the loader, in the order of the INSERT statement
+PRODUCT_FIELDS = [
+    "id_product",
+    "product_name",
+    "url",
+    "img",
+    "nutriscore",
+    "fat",
+    "saturated_fat",
+    "salt",
+    "sugar",
+    "category",
+    "last_modified_t",
+    "content_hash",
+] + [level_field(nutrient) for nutrient in NUTRIENTS]
+
+# Fields whose change makes the loader rewrite a product
+HASHED_FIELDS = PRODUCT_FIELDS[1:PRODUCT_FIELDS.index("last_modified_t")]
+
+NUTRISCORES = ["a", "b", "c", "d", "e"]
+
+
+class StageTimer:
+    """Time spent in each stage of an import, summed over the threads."""
+
+    def __init__(self):
+        self.stages = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0) + elapsed
+
+    def timed(self, name, iterable):
+        """Yield the items of `iterable`, timing their production as `name`."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+
+def peak_memory():
+    """Peak resident memory of the process in MB, None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak / 1024 ** (2 if sys.platform == "darwin" else 1)
+
+
+class ResultPage(list):
+    """Products extracted from one page of an OpenFoodFacts search."""
+
+    def __init__(self, products=(), has_next=False):
+        super().__init__(products)
+        self.has_next = has_next
+
+
+def build_session(pool_size=4, retries=3, backoff=0.5):
+    """
+    A keep-alive HTTP session shared by the fetching threads.
+
+    Failed connections and 5xx answers are retried with an exponential
+    backoff of `backoff` * 2 ** (retry - 1) seconds.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(500, 502, 503, 504),
+        )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=retry,
+        )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def extract_product(product):
+    """
+    Keep the fields of an OpenFoodFacts product used by PurBeurre.
+    Return None when the product has no valid nutriscore or misses a field.
+    """
+    grades = product.get("nutrition_grades_tags") or [""]
+    if grades[0] not in NUTRISCORES:
+        return None
+    try:
+        return {
+            "product_name": product["product_name"],
+            "product_id": int(product["_id"]),
+            "product_url": product["url"],
+            "product_img": product["image_small_url"],
+            "nutriscore": grades[0],
+            "fat": product["nutriments"]["fat_100g"],
+            "saturated_fat": product["nutriments"]["saturated-fat_100g"],
+            "salt": product["nutriments"]["salt_100g"],
+            "sugar": product["nutriments"]["sugars_100g"],
+            "categories": product["categories_prev_hierarchy"][:5],
+            "last_modified_t": product.get("last_modified_t"),
+            }
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+def modified_since(products, timestamp):
+    """Yield the raw products modified upstream after `timestamp`."""
+    for product in products:
+        if (product.get("last_modified_t") or 0) > timestamp:
+            yield product
+
+
+def content_hash(row):
+    """Hash of the imported fields of a product row."""
+    content = [str(row[field]) for field in HASHED_FIELDS]
+    return hashlib.sha1(json.dumps(content).encode("utf-8")).hexdigest()
+
+
+def iter_products(products):
+    """Yield the extracted products, dropping the unusable ones."""
+    for product in products:
+        product = extract_product(product)
+        if product is not None:
+            yield product
+
+
+def read_dump(path):
+    """
+    Stream the products of an OpenFoodFacts JSONL dump, gzipped or not.
+    Only one line is held in memory at a time.
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as dump:
+        for line in dump:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                product = json.loads(line)
+            except ValueError:
+                continue
+            yield product
+
+
+def chunks(iterable, size):
+    """Yield lists of at most `size` items from any iterable."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def to_decimal(value):
+    """Convert a nutriment quantity to a Decimal fitting Products fields."""
+    try:
+        value = Decimal(str(value)).quantize(Decimal("0.01"))
+    except (InvalidOperation, ValueError):
+        return None
+    # DecimalField(max_digits=5, decimal_places=2)
+    if not value.is_finite() or abs(value) >= 1000:
+        return None
+    return value
+
+
+class ProductLoader:
+    """
+    Upsert the products extracted from OpenFoodFacts by batches.
+
+    Each batch resolves its categories in one pass and writes its products
+    with a single statement inside a transaction. Products whose name is
+    already used by another product are skipped, and products whose content
+    hash did not change are left untouched.
+    """
+
+    def __init__(self, batch_size=500, timer=None):
+        self.batch_size = batch_size
+        self.timer = timer or StageTimer()
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.skipped = 0
+        # ids of the categories whose products were written or moved away
+        self.categories = set()
+        # categories whose parent conflict was logged
+        self._conflicts = set()
+        # most recent upstream modification seen
+        self.last_modified_t = None
+
+    def load(self, products):
+        for batch in chunks(products, self.batch_size):
+            self._load_batch(batch)
+
+    def report(self):
+        return "{} inserted, {} updated, {} unchanged, {} skipped".format(
+            self.inserted, self.updated, self.unchanged, self.skipped
+            )
+
+    @property
+    def rows(self):
+        """Number of products processed."""
+        return self.inserted + self.updated + self.unchanged + self.skipped
+
+    def _load_batch(self, batch):
+        with self.timer.stage("transform"):
+            rows = self._transform(batch)
+        if not rows:
+            return
+        with self.timer.stage("write"):
+            try:
+                with transaction.atomic():
+                    counts = self._write(rows)
+                self._count(*counts)
+            except (DataError, IntegrityError):
+                # isolate the offending products, the failed batch counted nothing
+                for row in rows:
+                    try:
+                        with transaction.atomic():
+                            counts = self._write([row])
+                        self._count(*counts)
+                    except (DataError, IntegrityError):
+                        self.skipped += 1
+
+    def _count(self, inserted, updated, unchanged, categories):
+        """Add the counts and the categories of a committed write."""
+        self.inserted += inserted
+        self.updated += updated
+        self.unchanged += unchanged
+        self.categories |= categories
+
+    def _transform(self, batch):
+        """Turn extracted products into rows, dropping the duplicates."""
+        batch = self._deduplicate(batch)
+        categories = self._resolve_categories(
+            {self._chain(prod) for prod in batch}
+            )
+        rows = []
+        for prod in batch:
+            row = {
+                "id_product": prod["product_id"],
+                "product_name": prod["product_name"],
+                "url": prod["product_url"],
+                "img": prod["product_img"],
+                "nutriscore": prod["nutriscore"],
+                "category": categories[self._chain(prod)],
+                }
+            for nutrient in NUTRIENTS:
+                row[nutrient] = to_decimal(prod[nutrient])
+            row["last_modified_t"] = prod.get("last_modified_t")
+            row["content_hash"] = content_hash(row)
+            for nutrient in NUTRIENTS:
+                row[level_field(nutrient)] = nutrient_level(nutrient, row[nutrient])
+            rows.append(row)
+
+            if row["last_modified_t"] is not None:
+                self.last_modified_t = max(
+                    self.last_modified_t or 0, row["last_modified_t"]
+                    )
+        return rows
+
+    def _chain(self, prod):
+        """Category names of a product, from the root to its own category."""
+        return tuple(str(name) for name in prod["categories"]) or ("en:unknown",)
+
+    def _deduplicate(self, batch):
+        """Keep one product per id and per name, names owned by other ids excepted."""
+        owners = dict(Products.objects.filter(
+            product_name__in={prod["product_name"] for prod in batch}
+            ).values_list("product_name", "id_product"))
+
+        ids = set()
+        unique = []
+        for prod in batch:
+            owner = owners.setdefault(prod["product_name"], prod["product_id"])
+            if owner != prod["product_id"] or prod["product_id"] in ids:
+                self.skipped += 1
+                continue
+            ids.add(prod["product_id"])
+            unique.append(prod)
+        return unique
+
+    def _resolve_categories(self, chains):
+        """
+        Return a {chain: leaf category pk} mapping. Missing categories are
+        created level by level. A category keeps the parent it was first
+        created with, a chain giving it another one is logged.
+        """
+        if not chains:
+            return {}
+        nodes = {
+            category.category_name: category
+            for category in Categories.objects.filter(
+                category_name__in={name for chain in chains for name in chain}
+                )
+            }
+
+        for level in range(max(len(chain) for chain in chains)):
+            missing = {}
+            for chain in chains:
+                if len(chain) <= level:
+                    continue
+                parent = nodes[chain[level - 1]] if level else None
+                if chain[level] in nodes:
+                    self._check_parent(nodes[chain[level]], parent)
+                    continue
+                missing[chain[level]] = Categories(category_name=chain[level], parent=parent)
+            if missing:
+                Categories.objects.bulk_create(missing.values())
+                nodes.update(
+                    (category.category_name, category)
+                    for category in Categories.objects.filter(category_name__in=missing)
+                    )
+
+        return {chain: nodes[chain[-1]].pk for chain in chains}
+
+    def _check_parent(self, category, parent):
+        """Log once per category a parent other than the one it has."""
+        parent_id = parent.pk if parent else None
+        if category.parent_id == parent_id or category.pk in self._conflicts:
+            return
+        self._conflicts.add(category.pk)
+        logger.warning(
+            "Category %s is below %s, not below %s.",
+            category.category_name,
+            category.parent.category_name if category.parent_id else "the root",
+            parent.category_name if parent else "the root",
+            )
+
+    def _write(self, rows):
+        """
+        Write `rows`, return the numbers of inserted, updated and unchanged
+        ones and the ids of the categories they were written in or moved from.
+        """
+        if connection.vendor == "postgresql":
+            return self._upsert(rows)
+        return self._update_or_create(rows)
+
+    def _upsert(self, rows):
+        """
+        INSERT ... ON CONFLICT DO UPDATE, only for rows whose hash changed.
+        Inserted rows are told apart from updated ones with xmax.
+        """
+        ids = [row["id_product"] for row in rows]
+        previous = dict(Products.objects.filter(pk__in=ids).values_list("pk", "category_id"))
+
+        table = Products._meta.db_table
+        columns = [Products._meta.get_field(f).column for f in PRODUCT_FIELDS]
+        pk = Products._meta.pk.column
+
+        placeholders = "({})".format(", ".join(["%s"] * len(columns)))
+        sql = (
+            "INSERT INTO {table} ({columns}) VALUES {values} "
+            "ON CONFLICT ({pk}) DO UPDATE SET {updates} "
+            "WHERE {table}.{hash} IS DISTINCT FROM EXCLUDED.{hash} "
+            "RETURNING {pk}, (xmax = 0)"
+            ).format(
+                table=table,
+                columns=", ".join(columns),
+                values=", ".join([placeholders] * len(rows)),
+                pk=pk,
+                hash=Products._meta.get_field("content_hash").column,
+                updates=", ".join(
+                    "{0} = EXCLUDED.{0}".format(c) for c in columns if c != pk
+                    ),
+                )
+        params = [row[field] for row in rows for field in PRODUCT_FIELDS]
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            written = cursor.fetchall()
+        inserted = sum(1 for _, created in written if created)
+
+        categories = {row["id_product"]: row["category"] for row in rows}
+        touched = set()
+        for pk, created in written:
+            touched.add(categories[pk])
+            if not created:
+                touched.add(previous[pk])
+        return inserted, len(written) - inserted, len(rows) - len(written), touched
+
+    def _update_or_create(self, rows):
+        """Portable fallback for databases without ON CONFLICT support."""
+        existing = {
+            pk: (content, category)
+            for pk, content, category in Products.objects.filter(
+                pk__in=[row["id_product"] for row in rows]
+                ).values_list("pk", "content_hash", "category_id")
+            }
+
+        created = []
+        updated = unchanged = 0
+        touched = set()
+        for row in rows:
+            fields = dict(row, category_id=row["category"])
+            del fields["category"]
+            if row["id_product"] not in existing:
+                created.append(Products(**fields))
+                touched.add(row["category"])
+            elif existing[row["id_product"]][0] == row["content_hash"]:
+                unchanged += 1
+            else:
+                Products.objects.filter(pk=row["id_product"]).update(**fields)
+                updated += 1
+                touched.update((row["category"], existing[row["id_product"]][1]))
+        Products.objects.bulk_create(created)
+        return len(created), updated, unchanged, touched
@@ -1,37 +1,182 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
 import requests
 
 from django.core.management.base import BaseCommand
-from openfoodfacts.models import Categories, Products
-from django.db import IntegrityError
+
+from openfoodfacts import thumbnails
+from openfoodfacts.models import Products, SyncCheckpoint
+from openfoodfacts.cache import bump_catalogue_version
+from openfoodfacts.substitutes import rebuild_substitutes, ranking_categories
+from ._private import (
+    ProductLoader, ResultPage, StageTimer, build_session, iter_products,
+    modified_since, peak_memory, read_dump
+    )
 
 
 class Command(BaseCommand):
 
     help = "Use it to update the database from OpenFoodFacts"
 
+    api_url = "https://fr.openfoodfacts.org/cgi/search.pl"
+
+    categories = [
+        "Biscuits et gâteaux",
+        "Fromages",
+        "Matières grasses",
+        "Poduits à tartiner",
+        "Petit-déjeuner",
+        "Charcuteries",
+        "Confiseries",
+        "Boissons sucrées",
+        "Jus et nectars de fruits",
+        "Gateaux",
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help="Number of products written per database statement.",
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help="Number of categories fetched concurrently.",
+        )
+        parser.add_argument(
+            '--timeout',
+            type=float,
+            default=30,
+            help="Timeout of each request to OpenFoodFacts, in seconds.",
+        )
+        parser.add_argument(
+            '--retries',
+            type=int,
+            default=3,
+            help="Number of retries of a failed request, with backoff.",
+        )
+        parser.add_argument(
+            '--all-pages',
+            action='store_true',
+            help="Walk every result page of each category, not only the first.",
+        )
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=1000,
+            help="Number of products requested per page.",
+        )
+        parser.add_argument(
+            '--dump',
+            help="Import an OpenFoodFacts JSONL dump (.jsonl or .jsonl.gz) "
+                 "instead of querying the API.",
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help="Only import the products modified since the last sync.",
+        )
+        parser.add_argument(
+            '--profile',
+            action='store_true',
+            help="Report the time spent in each stage, the rows per second "
+                 "and the peak memory.",
+        )
+        parser.add_argument(
+            '--thumbnails',
+            action='store_true',
+            help="Fetch the missing product images and store their thumbnails.",
+        )
+
     def handle(self, *args, **kwargs):
         self.stdout.write("Updating PurBeurre's database.", ending='\n')
+        started = time.perf_counter()
+        self.timer = StageTimer()
+        self.loader = ProductLoader(batch_size=kwargs.get('batch_size', 500), timer=self.timer)
+
+        source = 'dump' if kwargs.get('dump') else 'api'
+        self.since = None
+        if kwargs.get('incremental'):
+            checkpoint = SyncCheckpoint.objects.filter(source=source).first()
+            if checkpoint is not None:
+                self.since = checkpoint.last_modified_t
+        self.failed = []
+
+        if kwargs.get('dump'):
+            products = read_dump(kwargs['dump'])
+            if self.since is not None:
+                products = modified_since(products, self.since)
+            # reading and extracting the products is done lazily by the loader
+            self._insert(self.timer.timed("parse", iter_products(products)))
+            complete = True
+        else:
+            # an incremental sync walks the pages until the last checkpoint
+            all_pages = kwargs.get('all_pages', False) or self.since is not None
+            self._fetch(
+                workers=kwargs.get('workers', 4),
+                timeout=kwargs.get('timeout', 30),
+                retries=kwargs.get('retries', 3),
+                all_pages=all_pages,
+                page_size=kwargs.get('page_size', 1000),
+                )
+            complete = all_pages
+
+        if complete and not self.failed:
+            self._save_checkpoint(source)
+
+        self.stdout.write(self.loader.report(), ending='\n')
+
+        if self.loader.inserted or self.loader.updated:
+            # only the families of the written products are ranked again,
+            # build_substitutes ranks the whole catalogue
+            with self.timer.stage("substitutes"):
+                rebuild_substitutes(ranking_categories(self.loader.categories))
+            self.stdout.write("Substitutes rebuilt.", ending='\n')
+            # the cached pages show the previous catalogue
+            bump_catalogue_version()
 
-        categories = [
-            "Biscuits et gâteaux",
-            "Fromages",
-            "Matières grasses",
-            "Poduits à tartiner",
-            "Petit-déjeuner",
-            "Charcuteries",
-            "Confiseries",
-            "Boissons sucrées",
-            "Jus et nectars de fruits",
-            "Gateaux",
-        ]
+        if kwargs.get('thumbnails'):
+            with self.timer.stage("thumbnails"):
+                self._thumbnails(
+                    workers=kwargs.get('workers', 4),
+                    timeout=kwargs.get('timeout', 30),
+                    )
+
+        self.elapsed = time.perf_counter() - started
+        if kwargs.get('profile'):
+            self._profile()
 
-        for category in categories:
-            products = self._request_api(category)
-            self._insert(products)
+    def _fetch(self, workers, timeout, retries, all_pages, page_size):
+        """
+        Fetch the categories with a pool of threads. Pages are inserted by
+        this thread as soon as they arrive, and the next page of a category
+        is only requested once the previous one is in.
+        """
+        self.timeout = timeout
+        self.page_size = page_size
+        self.session = build_session(pool_size=workers, retries=retries)
 
-    def _request_api(self, category):
+        with self.session, ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = {
+                executor.submit(self._request_api, category): (category, 1)
+                for category in self.categories
+                }
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fetch in done:
+                    category, page = pending.pop(fetch)
+                    products = fetch.result()
+                    if products:
+                        self._insert(products)
+                    if all_pages and getattr(products, 'has_next', False):
+                        fetch = executor.submit(self._request_api, category, page + 1)
+                        pending[fetch] = (category, page + 1)
 
-        api_url = "https://fr.openfoodfacts.org/cgi/search.pl"
+    def _request_api(self, category, page=1):
 
         params = {
             'tagtype_0': 'categories',
@@ -39,66 +184,81 @@ class Command(BaseCommand):
             'tag_0': category,
             'action': 'process',
             'json': '1',
-            'page_size': '1000'
+            'page_size': self.page_size,
+            'page': page,
         }
+        if self.since is not None:
+            # most recently modified first
+            params['sort_by'] = 'last_modified_t'
 
         try:
-            products_data = requests.get(api_url, params=params)
-            products_data = products_data.json()
-
-            i = 0
-            content = []
-            for product in products_data["products"]:
-                nutrichar = ['a','b','c','d','e']
-
-
-                # Make sure that nutriscore have correct value
-                if str(*products_data["products"][i]["nutrition_grades_tags"]) in nutrichar:
-                    try:
-                        cat = ''
-                        cat = products_data["products"][i]["categories_prev_hierarchy"][:5]
-                        extract_data= {
-                            "product_name": products_data["products"][i]["product_name"],
-                            "product_id": int(products_data["products"][i]["_id"]),
-                            "product_url": products_data["products"][i]["url"],
-                            "product_img": products_data["products"][i]["image_small_url"],
-                            "nutriscore": str(*products_data["products"][i]["nutrition_grades_tags"]),
-                            "fat": products_data["products"][i]["nutriments"]["fat_100g"],
-                            "saturated_fat": products_data["products"][i]["nutriments"]["saturated-fat_100g"],
-                            "salt": products_data["products"][i]["nutriments"]["salt_100g"],
-                            "sugar": products_data["products"][i]["nutriments"]["sugars_100g"],
-                            "categories": cat
-                            }
-                        content.append(extract_data)
-                    except KeyError:
-                        pass
-                    except IndexError:
-                        pass
-                i += 1
-            return content
+            with self.timer.stage("fetch"):
+                products_data = self.session.get(
+                    self.api_url,
+                    params=params,
+                    timeout=self.timeout
+                    )
+                products_data.raise_for_status()
+
+            with self.timer.stage("parse"):
+                products_data = products_data.json()
+
+                products = products_data["products"]
+                has_next = bool(products) and (
+                    page * self.page_size < int(products_data.get("count", 0))
+                    )
+                if self.since is not None:
+                    recent = list(modified_since(products, self.since))
+                    # older products follow, the checkpoint is reached
+                    has_next = has_next and len(recent) == len(products)
+                    products = recent
+                return ResultPage(iter_products(products), has_next=has_next)
 
         except requests.exceptions.ConnectionError:
-            print("You must be connected in order to create/update database")
+            self.failed.append(category)
+            self.stderr.write(
+                "You must be connected in order to create/update database "
+                "({} could not be fetched)".format(category)
+                )
+        except (requests.exceptions.RequestException, ValueError) as error:
+            self.failed.append(category)
+            self.stderr.write("Could not fetch {}: {}".format(category, error))
 
     def _insert(self, prod_data):
-        for prod in prod_data:
+        self.loader.load(prod_data)
 
-            try:
-                cat, created = Categories.objects.get_or_create(
-                    category_name=prod["categories"]
-                    )
-                Products.objects.update_or_create(
-                    id_product=prod["product_id"],
-                    product_name=prod["product_name"],
-                    url=prod["product_url"],
-                    img=prod["product_img"],
-                    nutriscore=prod["nutriscore"],
-                    fat=prod["fat"],
-                    saturated_fat=prod["saturated_fat"],
-                    salt=prod["salt"],
-                    sugar=prod["sugar"],
-                    category=cat
-                )
-            # Ignore duplicate value
-            except IntegrityError:
-                continue
+    def _thumbnails(self, workers, timeout):
+        if not thumbnails.enabled():
+            self.stderr.write("Pillow with WebP support is not installed, no thumbnail made.", ending='\n')
+            return
+        done, failed = thumbnails.build_thumbnails(
+            Products.objects.values_list('id_product', 'img').iterator(),
+            workers=workers,
+            timeout=timeout,
+            )
+        self.stdout.write("Thumbnails of {} products made, {} failed.".format(done, failed), ending='\n')
+
+    def _profile(self):
+        """Print the time spent per stage, fetch and parse run in several threads."""
+        self.stdout.write("{:<15}{:>10}{:>10}".format("stage", "seconds", "share"))
+        for stage, seconds in self.timer.stages.items():
+            self.stdout.write("{:<15}{:>10.3f}{:>9.1f}%".format(
+                stage, seconds, seconds / self.elapsed * 100
+                ))
+        memory = peak_memory()
+        self.stdout.write("{} rows in {:.3f}s, {:.0f} rows/s, peak memory {}".format(
+            self.loader.rows,
+            self.elapsed,
+            self.loader.rows / self.elapsed if self.elapsed else 0,
+            "unknown" if memory is None else "{:.1f} MB".format(memory),
+            ))
+
+    def _save_checkpoint(self, source):
+        """Remember the most recent upstream modification imported."""
+        if self.loader.last_modified_t is None:
+            return
+        last_modified_t = max(self.loader.last_modified_t, self.since or 0)
+        SyncCheckpoint.objects.update_or_create(
+            source=source,
+            defaults={'last_modified_t': last_modified_t}
+            )
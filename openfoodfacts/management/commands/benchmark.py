@@ -0,0 +1,241 @@
+import json
+import random
+import threading
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import (
+    override_settings, setup_test_environment, teardown_test_environment
+    )
+from django.urls import reverse
+
+from openfoodfacts.models import Products
+from ._benchmark import WORDS, git_commit, measure, seed_catalogue, seed_user
+
+SCENARIOS = ["index", "products_list", "search", "detail", "saved"]
+
+NO_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Benchmark the PurBeurre pages on a synthetic catalogue seeded in a "
+        "test database, or against a running server with --base-url."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--products',
+            type=int,
+            default=10000,
+            help="Size of the synthetic catalogue.",
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=200,
+            help="Number of timed requests per page.",
+        )
+        parser.add_argument(
+            '--warmup',
+            type=int,
+            default=10,
+            help="Number of untimed requests per page.",
+        )
+        parser.add_argument(
+            '--scenario',
+            action='append',
+            choices=SCENARIOS,
+            help="Page to benchmark, every page by default. Can be repeated.",
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help="Seed of the catalogue and of the requested pages.",
+        )
+        parser.add_argument(
+            '--skip-substitutes',
+            action='store_true',
+            help="Do not rank the substitutes of the seeded catalogue, the search "
+                 "page then shows none. Saves the rebuild on the largest sizes.",
+        )
+        parser.add_argument(
+            '--keepdb',
+            action='store_true',
+            help="Keep the test database and its catalogue between runs.",
+        )
+        parser.add_argument(
+            '--no-cache',
+            action='store_true',
+            help="Render every page instead of serving the cached ones.",
+        )
+        parser.add_argument(
+            '--base-url',
+            help="Benchmark a running server, e.g. http://127.0.0.1:8000, "
+                 "with the products of its database. Queries are not counted.",
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=1,
+            help="Number of concurrent requests to the server of --base-url.",
+        )
+        parser.add_argument(
+            '--output',
+            help="Save the results to this JSON file.",
+        )
+        parser.add_argument(
+            '--compare',
+            help="Results of a previous run, to print the p95 changes.",
+        )
+
+    def handle(self, *args, **kwargs):
+        scenarios = kwargs.get('scenario') or SCENARIOS
+        self.rand = random.Random(kwargs.get('seed', 0))
+
+        if kwargs.get('base_url'):
+            results = self._run_http(kwargs['base_url'], scenarios, kwargs)
+        elif kwargs.get('no_cache'):
+            with override_settings(CACHES=NO_CACHE):
+                results = self._run_client(scenarios, kwargs)
+        else:
+            results = self._run_client(scenarios, kwargs)
+
+        report = {
+            "commit": git_commit(),
+            "date": datetime.now().isoformat(timespec='seconds'),
+            "database": connection.vendor,
+            "products": self.products,
+            "mode": "http" if kwargs.get('base_url') else "client",
+            "concurrency": kwargs.get('concurrency', 1) if kwargs.get('base_url') else 1,
+            "cache": not kwargs.get('no_cache', False),
+            "results": results,
+        }
+        self._print(report)
+
+        if kwargs.get('output'):
+            with open(kwargs['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+        if kwargs.get('compare'):
+            with open(kwargs['compare']) as previous:
+                self._compare(json.load(previous), report)
+
+    def _run_client(self, scenarios, kwargs):
+        """Seed a test database and request the pages with the test client."""
+        keepdb = kwargs.get('keepdb', False)
+        old_name = connection.settings_dict['NAME']
+        setup_test_environment(debug=False)
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+        try:
+            ids = list(Products.objects.values_list('pk', flat=True))
+            if not ids:
+                self.stdout.write("Seeding {} products...".format(kwargs.get('products', 10000)))
+                ids = seed_catalogue(
+                    kwargs.get('products', 10000),
+                    seed=kwargs.get('seed', 0),
+                    substitutes=not kwargs.get('skip_substitutes', False),
+                    )
+                seed_user(ids, seed=kwargs.get('seed', 0))
+            self.products = len(ids)
+            cache.clear()
+
+            anonymous = Client()
+            user = Client()
+            user.login(username="benchmark", password="benchmark")
+            results = {}
+            for scenario in scenarios:
+                client = user if scenario == "saved" else anonymous
+                results[scenario] = self._scenario(scenario, client.get, ids, kwargs)
+            return results
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+            teardown_test_environment()
+
+    def _run_http(self, base_url, scenarios, kwargs):
+        """Request the pages of a running server."""
+        if "saved" in scenarios:
+            raise CommandError("The saved page needs a login, use the test client.")
+        ids = list(Products.objects.values_list('pk', flat=True)[:100000])
+        if not ids:
+            raise CommandError("The database has no product.")
+        self.products = Products.objects.count()
+
+        # a keep-alive session per thread
+        sessions = threading.local()
+        base_url = base_url.rstrip('/')
+
+        def get(path):
+            if not hasattr(sessions, 'session'):
+                sessions.session = requests.Session()
+                # a keep-alive connection closed by a recycled worker is
+                # opened again, the error answers are not retried
+                sessions.session.mount(base_url, HTTPAdapter(
+                    max_retries=Retry(total=1, status_forcelist=())
+                    ))
+            return sessions.session.get(base_url + path)
+
+        results = {}
+        for scenario in scenarios:
+            results[scenario] = self._scenario(
+                scenario, get, ids, kwargs,
+                count_queries=False,
+                concurrency=kwargs.get('concurrency', 1)
+                )
+        return results
+
+    def _scenario(self, scenario, get, ids, kwargs, count_queries=True, concurrency=1):
+        paths = [self._path(scenario, ids) for i in range(kwargs.get('warmup', 10))]
+        measure(get, paths, count_queries, concurrency)
+        paths = [self._path(scenario, ids) for i in range(kwargs.get('requests', 200))]
+        return measure(get, paths, count_queries, concurrency)
+
+    def _path(self, scenario, ids):
+        """A page of `scenario` picked at random."""
+        if scenario == "index":
+            return reverse('index')
+        if scenario == "products_list":
+            return "{}?query={}".format(
+                reverse('openfoodfacts:products_list'), self.rand.choice(WORDS)
+                )
+        if scenario == "search":
+            return "{}?id_product={}".format(
+                reverse('openfoodfacts:search'), self.rand.choice(ids)
+                )
+        if scenario == "detail":
+            return reverse('openfoodfacts:detail', args=(self.rand.choice(ids),))
+        return reverse('openfoodfacts:saved')
+
+    def _print(self, report):
+        self.stdout.write("{products} products, {database}, commit {commit}".format(**report))
+        self.stdout.write("{:<15}{:>10}{:>10}{:>10}{:>10}{:>10}".format(
+            "page", "p50 ms", "p95 ms", "p99 ms", "queries", "req/s"
+            ))
+        for scenario, result in report["results"].items():
+            self.stdout.write("{:<15}{:>10}{:>10}{:>10}{:>10}{:>10}".format(
+                scenario,
+                result["p50_ms"],
+                result["p95_ms"],
+                result["p99_ms"],
+                "-" if result["queries"] is None else result["queries"],
+                result["throughput_rps"],
+                ))
+
+    def _compare(self, previous, report):
+        self.stdout.write("p95 compared to commit {}:".format(previous.get("commit")))
+        for scenario, result in report["results"].items():
+            before = previous["results"].get(scenario)
+            if not before:
+                continue
+            change = (result["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+            self.stdout.write("{:<15}{:>10} -> {:<10}{:+.1f}%".format(
+                scenario, before["p95_ms"], result["p95_ms"], change
+                ))
@@ -0,0 +1,133 @@
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+from io import StringIO
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from .api_off import Command as ImportCommand
+from ._benchmark import git_commit, write_dump
+from ._private import peak_memory
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Benchmark api_off: import a synthetic dump built from the test "
+        "fixture into a fresh test database, then import it again unchanged."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--products',
+            type=int,
+            default=20000,
+            help="Number of products of the dump.",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help="Batch size of the import.",
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help="Seed of the dump.",
+        )
+        parser.add_argument(
+            '--output',
+            help="Save the results to this JSON file.",
+        )
+        parser.add_argument(
+            '--compare',
+            help="Results of a previous run, to print the throughput changes.",
+        )
+
+    def handle(self, *args, **kwargs):
+        products = kwargs.get('products', 20000)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "products.jsonl.gz")
+            start = time.perf_counter()
+            write_dump(path, products, seed=kwargs.get('seed', 0))
+            self.stdout.write("Dump of {} products written in {:.1f}s.".format(
+                products, time.perf_counter() - start
+                ))
+
+            old_name = connection.settings_dict['NAME']
+            setup_test_environment(debug=False)
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                runs = {
+                    "first import": self._import(path, kwargs.get('batch_size', 500)),
+                    "unchanged import": self._import(path, kwargs.get('batch_size', 500)),
+                }
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+
+        report = {
+            "commit": git_commit(),
+            "date": datetime.now().isoformat(timespec='seconds'),
+            "database": connection.vendor,
+            "products": products,
+            "batch_size": kwargs.get('batch_size', 500),
+            "peak_memory_mb": peak_memory(),
+            "runs": runs,
+        }
+        self._print(report)
+
+        if kwargs.get('output'):
+            with open(kwargs['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+        if kwargs.get('compare'):
+            with open(kwargs['compare']) as previous:
+                self._compare(json.load(previous), report)
+
+    def _import(self, path, batch_size):
+        """Run api_off on the dump and return its figures."""
+        command = ImportCommand(stdout=StringIO(), stderr=StringIO())
+        command.handle(dump=path, batch_size=batch_size)
+        loader = command.loader
+        return {
+            "seconds": round(command.elapsed, 3),
+            "rows_per_second": round(loader.rows / command.elapsed, 1),
+            "inserted": loader.inserted,
+            "updated": loader.updated,
+            "unchanged": loader.unchanged,
+            "skipped": loader.skipped,
+            "stages": {
+                stage: round(seconds, 3) for stage, seconds in command.timer.stages.items()
+            },
+        }
+
+    def _print(self, report):
+        self.stdout.write("{products} products, {database}, batches of {batch_size}, "
+                          "commit {commit}".format(**report))
+        for name, run in report["runs"].items():
+            self.stdout.write("{}: {}s, {} rows/s ({})".format(
+                name,
+                run["seconds"],
+                run["rows_per_second"],
+                ", ".join("{} {}s".format(stage, seconds) for stage, seconds in run["stages"].items()),
+                ))
+        if report["peak_memory_mb"] is not None:
+            self.stdout.write("Peak memory {:.1f} MB".format(report["peak_memory_mb"]))
+
+    def _compare(self, previous, report):
+        self.stdout.write("Throughput compared to commit {}:".format(previous.get("commit")))
+        for name, run in report["runs"].items():
+            before = previous["runs"].get(name)
+            if not before:
+                continue
+            change = (run["rows_per_second"] - before["rows_per_second"]) \
+                / before["rows_per_second"] * 100
+            self.stdout.write("{:<20}{:>10} -> {:<10}{:+.1f}%".format(
+                name, before["rows_per_second"], run["rows_per_second"], change
+                ))
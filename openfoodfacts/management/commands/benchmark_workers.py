@@ -0,0 +1,153 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from io import StringIO
+
+import requests
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from ._benchmark import git_commit
+
+CONFIG = os.path.join(settings.BASE_DIR, "purbeurre_project", "gunicorn_conf.py")
+
+WORKER_CLASSES = ["sync", "gthread", "gevent"]
+
+# The saved page needs a login, see benchmark --base-url
+SCENARIOS = ["index", "products_list", "search", "detail"]
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Benchmark the gunicorn worker classes: start gunicorn with "
+        "purbeurre_project/gunicorn_conf.py for each class and run the "
+        "benchmark command against it, with concurrent requests."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--worker-class',
+            action='append',
+            choices=WORKER_CLASSES,
+            help="Worker class to benchmark, every class by default. Can be repeated.",
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=16,
+            help="Number of concurrent requests.",
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=500,
+            help="Number of timed requests per page.",
+        )
+        parser.add_argument(
+            '--port',
+            type=int,
+            default=8765,
+            help="Port of the benchmarked servers.",
+        )
+        parser.add_argument(
+            '--output',
+            help="Save the results to this JSON file.",
+        )
+
+    def handle(self, *args, **kwargs):
+        results = {}
+        for worker_class in kwargs.get('worker_class') or WORKER_CLASSES:
+            if worker_class == "gevent" and not self._has_gevent():
+                self.stderr.write("gevent is not installed, skipped.")
+                continue
+            self.stdout.write("Benchmarking {} workers...".format(worker_class))
+            results[worker_class] = self._benchmark(worker_class, kwargs)
+
+        report = {
+            "commit": git_commit(),
+            "concurrency": kwargs.get('concurrency', 16),
+            "results": results,
+        }
+        self._print(report)
+        if kwargs.get('output'):
+            with open(kwargs['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+
+    def _has_gevent(self):
+        try:
+            import gevent  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def _benchmark(self, worker_class, kwargs):
+        """Start gunicorn with `worker_class` and benchmark it."""
+        port = kwargs.get('port', 8765)
+        base_url = "http://127.0.0.1:{}".format(port)
+        env = dict(
+            os.environ,
+            PORT=str(port),
+            GUNICORN_WORKER_CLASS=worker_class,
+            GUNICORN_ACCESSLOG="",
+            DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE,
+            )
+        server = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", CONFIG, "purbeurre_project.wsgi"],
+            env=env,
+            cwd=settings.BASE_DIR,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            )
+        try:
+            self._wait(server, base_url)
+            with tempfile.NamedTemporaryFile(suffix=".json") as output:
+                call_command(
+                    'benchmark',
+                    base_url=base_url,
+                    scenario=SCENARIOS,
+                    concurrency=kwargs.get('concurrency', 16),
+                    requests=kwargs.get('requests', 500),
+                    output=output.name,
+                    stdout=StringIO(),
+                    )
+                return json.load(output)["results"]
+        finally:
+            server.terminate()
+            server.wait(timeout=60)
+
+    def _wait(self, server, base_url, timeout=60):
+        """Wait for the server to answer."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError("gunicorn exited with code {}.".format(server.returncode))
+            try:
+                requests.get(base_url + "/", timeout=5)
+                return
+            except requests.RequestException:
+                time.sleep(0.2)
+        raise CommandError("gunicorn did not answer within {}s.".format(timeout))
+
+    def _print(self, report):
+        self.stdout.write("{} concurrent requests, commit {}".format(
+            report["concurrency"], report["commit"]
+            ))
+        self.stdout.write("{:<15}{:<10}{:>10}{:>10}{:>10}".format(
+            "page", "workers", "p50 ms", "p95 ms", "req/s"
+            ))
+        for scenario in SCENARIOS:
+            for worker_class, results in report["results"].items():
+                result = results[scenario]
+                self.stdout.write("{:<15}{:<10}{:>10}{:>10}{:>10}".format(
+                    scenario,
+                    worker_class,
+                    result["p50_ms"],
+                    result["p95_ms"],
+                    result["throughput_rps"],
+                    ))
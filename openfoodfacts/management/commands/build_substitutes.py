@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from openfoodfacts.cache import bump_catalogue_version
+from openfoodfacts.models import Categories
+from openfoodfacts.substitutes import rebuild_substitutes
+
+
+class Command(BaseCommand):
+
+    help = "Rank again the substitutes of the products, see openfoodfacts.substitutes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--category',
+            action='append',
+            help="Name of a category to rebuild, every category by default. "
+                 "Can be repeated.",
+        )
+
+    def handle(self, *args, **kwargs):
+        names = kwargs.get('category')
+        categories = None
+        if names:
+            categories = dict(Categories.objects.filter(
+                category_name__in=names
+                ).values_list('category_name', 'pk'))
+            missing = set(names) - set(categories)
+            if missing:
+                raise CommandError(
+                    "Unknown categories: {}".format(", ".join(sorted(missing)))
+                    )
+            categories = categories.values()
+
+        rebuild_substitutes(categories)
+        bump_catalogue_version()
+        self.stdout.write("Substitutes rebuilt.", ending='\n')
@@ -0,0 +1,145 @@
+"""
+Per-request instrumentation, cheap enough to stay on in production.
+
+A sample of the requests is timed: wall time, number and duration of the
+database queries, and response size. Each sampled response gets a
+Server-Timing header, and the figures are aggregated per view name. The
+aggregates are logged to the "openfoodfacts.metrics" logger every
+METRICS_LOG_INTERVAL seconds and served to staff members as JSON.
+"""
+import logging
+import random
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+LOG_INTERVAL = getattr(settings, 'METRICS_LOG_INTERVAL', 60)
+
+
+class QueryTimer:
+    """Database execute wrapper counting and timing the queries."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+class ViewStats:
+    """Sums and maximum of the measures of a view."""
+
+    __slots__ = ('requests', 'time', 'max_time', 'queries', 'db_time', 'size')
+
+    def __init__(self):
+        self.requests = 0
+        self.time = 0.0
+        self.max_time = 0.0
+        self.queries = 0
+        self.db_time = 0.0
+        self.size = 0
+
+    def add(self, duration, queries, db_time, size):
+        self.requests += 1
+        self.time += duration
+        self.max_time = max(self.max_time, duration)
+        self.queries += queries
+        self.db_time += db_time
+        self.size += size
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'avg_ms': round(self.time / self.requests * 1000, 2),
+            'max_ms': round(self.max_time * 1000, 2),
+            'avg_queries': round(self.queries / self.requests, 2),
+            'avg_db_ms': round(self.db_time / self.requests * 1000, 2),
+            'avg_bytes': self.size // self.requests,
+        }
+
+
+class Registry:
+    """The stats of the sampled requests of this process, per view name."""
+
+    def __init__(self, log_interval=LOG_INTERVAL):
+        self.log_interval = log_interval
+        self._lock = threading.Lock()
+        self._views = {}
+        self._since = time.time()
+        self._logged_at = time.monotonic()
+
+    def record(self, view, duration, queries, db_time, size):
+        with self._lock:
+            self._views.setdefault(view, ViewStats()).add(duration, queries, db_time, size)
+            due = time.monotonic() - self._logged_at >= self.log_interval
+            if due:
+                self._logged_at = time.monotonic()
+        if due:
+            self.log()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'since': self._since,
+                'views': {view: stats.as_dict() for view, stats in self._views.items()},
+            }
+
+    def log(self):
+        for view, stats in sorted(self.snapshot()['views'].items()):
+            logger.info(
+                "view=%s requests=%d avg_ms=%s max_ms=%s avg_queries=%s avg_db_ms=%s avg_bytes=%d",
+                view, stats['requests'], stats['avg_ms'], stats['max_ms'],
+                stats['avg_queries'], stats['avg_db_ms'], stats['avg_bytes'],
+                )
+
+    def reset(self):
+        with self._lock:
+            self._views = {}
+            self._since = time.time()
+
+
+registry = Registry()
+
+
+class RequestMetricsMiddleware:
+    """Time a sample of the requests, see the module docstring."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'METRICS_SAMPLE_RATE', 0.1)
+
+    def __call__(self, request):
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        timers = [QueryTimer() for connection in connections.all()]
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection, timer in zip(connections.all(), timers):
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        queries = sum(timer.count for timer in timers)
+        db_time = sum(timer.duration for timer in timers)
+        size = 0 if response.streaming else len(response.content)
+        match = getattr(request, 'resolver_match', None)
+        registry.record(match.view_name if match else 'unresolved', duration, queries, db_time, size)
+
+        response['Server-Timing'] = (
+            'db;dur={:.1f};desc="{} queries", app;dur={:.1f}'.format(
+                db_time * 1000, queries, (duration - db_time) * 1000
+                )
+            )
+        return response
@@ -0,0 +1,82 @@
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    """Text search configuration, trigger and GIN index (PostgreSQL only)."""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_available_extensions WHERE name = 'unaccent'"
+            )
+        unaccent = cursor.fetchone() is not None
+
+    schema_editor.execute(
+        "CREATE TEXT SEARCH CONFIGURATION purbeurre_french "
+        "(COPY = pg_catalog.french)"
+        )
+    if unaccent:
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS unaccent")
+        schema_editor.execute(
+            "ALTER TEXT SEARCH CONFIGURATION purbeurre_french "
+            "ALTER MAPPING FOR hword, hword_part, word WITH unaccent, french_stem"
+            )
+
+    schema_editor.execute("""
+        CREATE FUNCTION openfoodfacts_products_search_vector() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := to_tsvector(
+                'purbeurre_french', coalesce(NEW.product_name, '')
+                );
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """)
+    schema_editor.execute("""
+        CREATE TRIGGER openfoodfacts_products_search_vector
+        BEFORE INSERT OR UPDATE ON openfoodfacts_products
+        FOR EACH ROW EXECUTE PROCEDURE openfoodfacts_products_search_vector()
+        """)
+    schema_editor.execute(
+        "UPDATE openfoodfacts_products SET search_vector = "
+        "to_tsvector('purbeurre_french', coalesce(product_name, ''))"
+        )
+    schema_editor.execute(
+        "CREATE INDEX openfoodfacts_products_search_idx "
+        "ON openfoodfacts_products USING gin(search_vector)"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    schema_editor.execute("DROP INDEX IF EXISTS openfoodfacts_products_search_idx")
+    schema_editor.execute(
+        "DROP TRIGGER IF EXISTS openfoodfacts_products_search_vector "
+        "ON openfoodfacts_products"
+        )
+    schema_editor.execute(
+        "DROP FUNCTION IF EXISTS openfoodfacts_products_search_vector()"
+        )
+    schema_editor.execute(
+        "DROP TEXT SEARCH CONFIGURATION IF EXISTS purbeurre_french"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openfoodfacts', '0006_auto_20180412_2242'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='products',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
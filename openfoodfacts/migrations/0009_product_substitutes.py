@@ -0,0 +1,49 @@
+# Generated by Django 2.0.3 on 2026-10-18 13:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def rank_substitutes(apps, schema_editor):
+    """Rank the substitutes of the products already imported."""
+    schema_editor.execute("""
+        INSERT INTO openfoodfacts_productsubstitutes (origin_id, replacement_id, rank)
+        SELECT origin_id, replacement_id, rank FROM (
+            SELECT o.id_product AS origin_id,
+                   r.id_product AS replacement_id,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY o.id_product
+                       ORDER BY r.nutriscore, r.id_product
+                   ) AS rank
+            FROM openfoodfacts_products o
+            JOIN openfoodfacts_products r
+              ON r.category_id = o.category_id
+             AND r.nutriscore <= o.nutriscore
+             AND r.id_product <> o.id_product
+        ) ranked
+        WHERE rank <= 90
+        """)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openfoodfacts', '0008_sync_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSubstitutes',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveIntegerField()),
+                ('origin', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ranked_substitutes', to='openfoodfacts.Products')),
+                ('replacement', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rankings', to='openfoodfacts.Products')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='productsubstitutes',
+            unique_together={('origin', 'rank')},
+        ),
+        migrations.RunPython(rank_substitutes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 2.0.3 on 2026-10-18 13:46
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def remove_duplicate_substitutes(apps, schema_editor):
+    """Keep the first save of each (user, origin, replacement)."""
+    Substitutes = apps.get_model('openfoodfacts', 'Substitutes')
+    first_saves = Substitutes.objects.values(
+        'user', 'origin', 'replacement'
+        ).annotate(first=Min('id')).values('first')
+    Substitutes.objects.exclude(id__in=list(first_saves)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('openfoodfacts', '0009_product_substitutes'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_substitutes, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='substitutes',
+            unique_together={('user', 'origin', 'replacement')},
+        ),
+        migrations.AddIndex(
+            model_name='products',
+            index=models.Index(fields=['category', 'nutriscore'], name='products_category_nutri_idx'),
+        ),
+    ]
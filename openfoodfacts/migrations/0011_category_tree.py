@@ -0,0 +1,70 @@
+# Generated by Django 2.0.3 on 2026-10-18 13:51
+
+import ast
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_tree(apps, schema_editor):
+    """
+    Categories used to be the str() of the first five tags of the product
+    hierarchy. Turn each tag into a node and link products to the last one.
+    """
+    Categories = apps.get_model('openfoodfacts', 'Categories')
+    Products = apps.get_model('openfoodfacts', 'Products')
+    nodes = {}
+
+    def node(chain):
+        name = chain[-1]
+        if name not in nodes:
+            parent = node(chain[:-1]) if len(chain) > 1 else None
+            nodes[name], created = Categories.objects.get_or_create(
+                category_name=name,
+                defaults={
+                    'parent': parent,
+                    'depth': parent.depth + 1 if parent else 0,
+                    'path': '{}{}/'.format(parent.path if parent else '/', name),
+                    }
+                )
+        return nodes[name]
+
+    for old in Categories.objects.filter(category_name__startswith='['):
+        try:
+            chain = [str(tag) for tag in ast.literal_eval(old.category_name)]
+        except (ValueError, SyntaxError):
+            continue
+        leaf = node(chain or ['en:unknown'])
+        Products.objects.filter(category=old).update(category=leaf)
+        old.delete()
+
+    # anything left is a root
+    for category in Categories.objects.filter(path=''):
+        category.path = '/{}/'.format(category.category_name)
+        category.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openfoodfacts', '0010_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='categories',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='categories',
+            name='parent',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='openfoodfacts.Categories'),
+        ),
+        migrations.AddField(
+            model_name='categories',
+            name='path',
+            field=models.TextField(db_index=True, default=''),
+        ),
+        migrations.RunPython(build_tree, migrations.RunPython.noop),
+    ]
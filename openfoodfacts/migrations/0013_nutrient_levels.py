@@ -0,0 +1,41 @@
+# Generated by Django 2.0.3 on 2026-10-18 13:56
+
+from django.db import migrations, models
+
+from openfoodfacts.nutrients import update_levels
+
+
+def compute_levels(apps, schema_editor):
+    Products = apps.get_model('openfoodfacts', 'Products')
+    update_levels(Products.objects.all())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openfoodfacts', '0012_catalogue_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='products',
+            name='fat_level',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'low'), (2, 'moderate'), (3, 'high')], null=True),
+        ),
+        migrations.AddField(
+            model_name='products',
+            name='salt_level',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'low'), (2, 'moderate'), (3, 'high')], null=True),
+        ),
+        migrations.AddField(
+            model_name='products',
+            name='saturated_fat_level',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'low'), (2, 'moderate'), (3, 'high')], null=True),
+        ),
+        migrations.AddField(
+            model_name='products',
+            name='sugar_level',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'low'), (2, 'moderate'), (3, 'high')], null=True),
+        ),
+        migrations.RunPython(compute_levels, migrations.RunPython.noop),
+    ]
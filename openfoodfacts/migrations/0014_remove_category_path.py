@@ -0,0 +1,21 @@
+# Generated by Django 2.0.3 on 2026-10-18 15:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openfoodfacts', '0013_nutrient_levels'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='categories',
+            name='depth',
+        ),
+        migrations.RemoveField(
+            model_name='categories',
+            name='path',
+        ),
+    ]
@@ -1,13 +1,28 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchVectorField
+
+from .nutrients import LEVELS, NUTRIENTS, level_field, nutrient_level
 
 
 class Categories(models.Model):
+    """
+    A node of the OpenFoodFacts category tree, e.g. "en:hazelnut-spreads".
+    The family of a category, its parent and the children of it, is found
+    through the indexed `parent` link.
+    """
     category_name = models.CharField(max_length=255, unique=True)
+    parent = models.ForeignKey("self", related_name="children", on_delete=models.CASCADE, null=True)
 
     def __str__(self):
         return self.category_name
 
+    @property
+    def label(self):
+        """Readable name, "en:hazelnut-spreads" becomes "Hazelnut spreads"."""
+        name = self.category_name.split(":")[-1].replace("-", " ").strip()
+        return name[:1].upper() + name[1:]
+
 
 class Products(models.Model):
     id_product = models.BigIntegerField(primary_key=True)
@@ -20,6 +35,27 @@ class Products(models.Model):
     sugar = models.DecimalField(max_digits=5, decimal_places=2, null=True)
     nutriscore = models.CharField(max_length=1, null=True)
     category = models.ForeignKey("Categories", on_delete=models.CASCADE)
+    # Filled by a database trigger on PostgreSQL, see openfoodfacts.search
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Upstream modification time and hash of the imported fields, see api_off
+    last_modified_t = models.BigIntegerField(null=True)
+    content_hash = models.CharField(max_length=40, null=True)
+    # Traffic lights of the nutrients, see openfoodfacts.nutrients
+    fat_level = models.PositiveSmallIntegerField(choices=LEVELS, null=True)
+    saturated_fat_level = models.PositiveSmallIntegerField(choices=LEVELS, null=True)
+    salt_level = models.PositiveSmallIntegerField(choices=LEVELS, null=True)
+    sugar_level = models.PositiveSmallIntegerField(choices=LEVELS, null=True)
+
+    class Meta:
+        indexes = [
+            # substitutes of a product: same category, better nutriscore
+            models.Index(fields=["category", "nutriscore"], name="products_category_nutri_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        for nutrient in NUTRIENTS:
+            setattr(self, level_field(nutrient), nutrient_level(nutrient, getattr(self, nutrient)))
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return str({
@@ -37,9 +73,52 @@ class Substitutes(models.Model):
     replacement = models.ForeignKey(Products, related_name="replacement", on_delete=models.CASCADE)
     user = models.ForeignKey(User, related_name='user', on_delete=models.CASCADE, null=True)
 
+    class Meta:
+        # a user saves a substitute once, also the index of the search and saved views
+        unique_together = ("user", "origin", "replacement")
+
     def __str__(self):
         return str({
             "origin": self.origin,
             "replacement": self.replacement,
             "user": self.user
         })
+
+
+class SyncCheckpoint(models.Model):
+    """Most recent upstream modification imported by api_off, per source."""
+    source = models.CharField(max_length=20, unique=True)
+    last_modified_t = models.BigIntegerField()
+    synced_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "{}: {}".format(self.source, self.last_modified_t)
+
+
+class ProductSubstitutes(models.Model):
+    """
+    Precomputed substitutes of a product, best first.
+    Built by openfoodfacts.substitutes at the end of each import.
+    """
+    origin = models.ForeignKey(Products, related_name="ranked_substitutes", on_delete=models.CASCADE)
+    replacement = models.ForeignKey(Products, related_name="rankings", on_delete=models.CASCADE)
+    rank = models.PositiveIntegerField()
+
+    class Meta:
+        # also the index read by the search view
+        unique_together = ("origin", "rank")
+
+    def __str__(self):
+        return "{} -> {} ({})".format(self.origin_id, self.replacement_id, self.rank)
+
+
+class CatalogueVersion(models.Model):
+    """
+    Version of the imported catalogue, bumped by api_off after each import.
+    Part of the key of the cached pages, see openfoodfacts.cache.
+    """
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return str(self.version)
@@ -0,0 +1,75 @@
+"""
+Nutrient levels of the products, the traffic lights of OpenFoodFacts.
+
+A quantity for 100g is low below the first threshold, moderate up to the
+second one included and high above. The levels are stored on Products by
+api_off so that pages and filters read them instead of computing them.
+"""
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.db.models import Case, IntegerField, Value, When
+
+LOW = 1
+MODERATE = 2
+HIGH = 3
+
+LEVELS = (
+    (LOW, "low"),
+    (MODERATE, "moderate"),
+    (HIGH, "high"),
+)
+
+# (moderate from, high above) in grams for 100g
+THRESHOLDS = OrderedDict([
+    ("fat", (Decimal("3"), Decimal("20"))),
+    ("saturated_fat", (Decimal("1.5"), Decimal("5"))),
+    ("salt", (Decimal("0.3"), Decimal("1.5"))),
+    ("sugar", (Decimal("5"), Decimal("12.5"))),
+])
+
+NUTRIENTS = list(THRESHOLDS)
+
+IMAGES_URL = "https://static.openfoodfacts.org/images/misc/{}_30.png"
+
+
+def level_field(nutrient):
+    return "{}_level".format(nutrient)
+
+
+def nutrient_level(nutrient, quantity):
+    """Level of a quantity of `nutrient`, None when the quantity is unknown."""
+    if quantity is None:
+        return None
+    moderate, high = THRESHOLDS[nutrient]
+    if 0 <= quantity < moderate:
+        return LOW
+    if moderate <= quantity <= high:
+        return MODERATE
+    return HIGH
+
+
+def level_expression(nutrient):
+    """nutrient_level() as a SQL expression."""
+    moderate, high = THRESHOLDS[nutrient]
+    return Case(
+        When(**{nutrient + "__gte": 0, nutrient + "__lt": moderate}, then=Value(LOW)),
+        When(**{nutrient + "__gte": moderate, nutrient + "__lte": high}, then=Value(MODERATE)),
+        When(**{nutrient + "__isnull": False}, then=Value(HIGH)),
+        default=None,
+        output_field=IntegerField(),
+    )
+
+
+def update_levels(queryset):
+    """Compute the levels of every product of `queryset` with one UPDATE."""
+    return queryset.update(**{
+        level_field(nutrient): level_expression(nutrient) for nutrient in NUTRIENTS
+    })
+
+
+def level_image(level):
+    """Traffic light image of a level, empty for an unknown level."""
+    if level is None:
+        return ""
+    return IMAGES_URL.format(dict(LEVELS)[level])
@@ -0,0 +1,149 @@
+"""
+Keyset pagination.
+
+Django's Paginator counts the rows then reads a page with OFFSET, so deep
+pages get slower and every page pays for a COUNT(*). KeysetPaginator
+reads the rows following (or preceding) the last key seen instead, which
+costs the same on every page. Positions are passed around as opaque
+cursor tokens.
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import F
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+def encode_cursor(direction, key):
+    position = json.dumps([direction, key]).encode('utf-8')
+    return base64.urlsafe_b64encode(position).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the (direction, key) of a cursor, or None if it is invalid."""
+    if not cursor:
+        return None
+    try:
+        position = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, key = json.loads(position.decode('utf-8'))
+    except (ValueError, TypeError):
+        return None
+    if direction not in (NEXT, PREVIOUS) or not isinstance(key, (int, str)):
+        return None
+    return direction, key
+
+
+def approximate_count(queryset):
+    """Row count estimated by the PostgreSQL planner, exact elsewhere."""
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+
+class KeysetPage:
+    """A page of objects, iterable like the pages of Django's Paginator."""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None, total=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.total = total
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Paginate a queryset on a unique key, `pk` or any field or lookup
+    path (e.g. 'rankings__rank') with unique values within the queryset.
+    When `with_total` is set, the first page also carries an approximate
+    number of objects.
+    """
+
+    def __init__(self, queryset, per_page, key='pk', with_total=False):
+        self.queryset = queryset.annotate(keyset_key=F(key))
+        self.key_field = self.queryset.query.annotations['keyset_key'].output_field
+        self.per_page = per_page
+        self.with_total = with_total
+
+    def page(self, cursor=None):
+        position = decode_cursor(cursor)
+        if position is not None:
+            position = self._clean(position)
+        if position is None:
+            return self._forward(None)
+        direction, key = position
+        if direction == NEXT:
+            page = self._forward(key)
+            if not page.object_list:
+                # the following objects are gone, show the last page
+                page = self._backward(None)
+            return page
+        return self._backward(key)
+
+    def _clean(self, position):
+        """Convert the key of a cursor to the type of the key field, None if it does not fit."""
+        direction, key = position
+        try:
+            key = self.key_field.to_python(key)
+        except ValidationError:
+            return None
+        if key is None:
+            return None
+        return direction, key
+
+    def _forward(self, after):
+        queryset = self.queryset.order_by('keyset_key')
+        if after is not None:
+            queryset = queryset.filter(keyset_key__gt=after)
+        rows = list(queryset[:self.per_page + 1])
+        objects = rows[:self.per_page]
+
+        page = KeysetPage(objects)
+        if len(rows) > self.per_page:
+            page.next_cursor = encode_cursor(NEXT, objects[-1].keyset_key)
+        if after is not None and objects:
+            page.previous_cursor = encode_cursor(PREVIOUS, objects[0].keyset_key)
+        if after is None and self.with_total:
+            page.total = approximate_count(self.queryset)
+        return page
+
+    def _backward(self, before):
+        queryset = self.queryset.order_by('-keyset_key')
+        if before is not None:
+            queryset = queryset.filter(keyset_key__lt=before)
+        rows = list(queryset[:self.per_page + 1])
+        objects = rows[:self.per_page][::-1]
+
+        page = KeysetPage(objects)
+        if len(rows) > self.per_page:
+            page.previous_cursor = encode_cursor(PREVIOUS, objects[0].keyset_key)
+        if before is not None and objects:
+            page.next_cursor = encode_cursor(NEXT, objects[-1].keyset_key)
+        return page
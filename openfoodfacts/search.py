@@ -0,0 +1,59 @@
+"""
+Product name search.
+
+On PostgreSQL, products are matched against the `search_vector` column,
+a tsvector kept up to date by a trigger (see migration 0007) with French
+stemming and accent folding, and ranked with ts_rank.
+Other databases fall back to a case insensitive substring match, which
+keeps the test suite runnable on SQLite.
+"""
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import Case, F, IntegerField, Value, When
+
+from .models import Products
+
+# Text search configuration created by migration 0007
+SEARCH_CONFIG = 'purbeurre_french'
+
+
+class PrefixSearchQuery(SearchQuery):
+    """
+    A tsquery matching every word of the user query as a prefix,
+    so that "nutel" still finds "nutella" while the user is typing.
+    """
+
+    def __init__(self, value, **kwargs):
+        words = re.findall(r'\w+', value)
+        value = ' & '.join('{}:*'.format(word) for word in words)
+        super().__init__(value, **kwargs)
+
+    def as_sql(self, compiler, connection):
+        sql, params = super().as_sql(compiler, connection)
+        return sql.replace('plainto_tsquery', 'to_tsquery', 1), params
+
+
+def search_products(query, queryset=None):
+    """Return the products whose name matches the query, best match first."""
+    if queryset is None:
+        queryset = Products.objects.all()
+
+    if connection.vendor == 'postgresql':
+        if not re.search(r'\w', query):
+            return queryset.none()
+        search_query = PrefixSearchQuery(query, config=SEARCH_CONFIG)
+        return queryset.filter(search_vector=search_query).annotate(
+            rank=SearchRank(F('search_vector'), search_query)
+            ).order_by('-rank', 'nutriscore')
+
+    # Fallback: exact matches first, then names starting with the query
+    return queryset.filter(product_name__icontains=query).annotate(
+        rank=Case(
+            When(product_name__iexact=query, then=Value(2)),
+            When(product_name__istartswith=query, then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField(),
+            )
+        ).order_by('-rank', 'nutriscore')
@@ -0,0 +1,21 @@
+// Suggest product names while typing in the search boxes
+(function($) {
+  "use strict";
+
+  var timer;
+
+  $('input[data-autocomplete]').on('input', function() {
+    var input = $(this);
+    var list = $('#' + input.attr('list'));
+    clearTimeout(timer);
+    timer = setTimeout(function() {
+      $.getJSON(input.data('autocomplete'), {q: input.val()}, function(data) {
+        list.empty();
+        $.each(data.products, function(i, product) {
+          list.append($('<option>').attr('value', product.product_name));
+        });
+      });
+    }, 100);
+  });
+
+})(jQuery);
@@ -0,0 +1,23 @@
+from django import template
+
+from openfoodfacts import thumbnails
+
+register = template.Library()
+
+
+@register.inclusion_tag('openfoodfacts/product_image.html')
+def product_image(product, size):
+    """
+    The image of a product at one of the thumbnails.SIZES, served from the
+    local thumbnails when Pillow is installed.
+    """
+    width, height = thumbnails.SIZES[size]
+    context = {
+        "product": product,
+        "width": width,
+        "height": height,
+    }
+    if thumbnails.enabled() and product.img:
+        context["webp"] = thumbnails.thumbnail_url(product.id_product, product.img, size, "webp")
+        context["jpg"] = thumbnails.thumbnail_url(product.id_product, product.img, size, "jpg")
+    return context
@@ -0,0 +1,129 @@
+"""
+Query guard for the view tests.
+
+QueryGuardTestCase runs each request of its test client under a database
+execute wrapper, and fails the test when a request runs more than
+`max_queries` queries, repeats a query of the same shape more than
+`max_repeats` times (an N+1 loop), or runs a query slower than
+`slow_query_ms`. The failure lists the offending SQL with the call sites
+in the application code.
+"""
+import os
+import re
+import time
+import traceback
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connection
+from django.test import Client, TestCase
+
+MAX_QUERIES = getattr(settings, 'QUERY_GUARD_MAX_QUERIES', 12)
+MAX_REPEATS = getattr(settings, 'QUERY_GUARD_MAX_REPEATS', 3)
+SLOW_QUERY_MS = getattr(settings, 'QUERY_GUARD_SLOW_QUERY_MS', 1000)
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TESTS_DIR = os.path.join(APP_DIR, 'tests')
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+PLACEHOLDER_LISTS = re.compile(r"\((?:\s*(?:%s|\?)\s*,)*\s*(?:%s|\?)\s*\)")
+
+
+def query_shape(sql):
+    """The SQL with its literals and lists of parameters folded."""
+    sql = LITERALS.sub('?', sql)
+    return PLACEHOLDER_LISTS.sub('(...)', sql)
+
+
+def call_site():
+    """The innermost frame of the application code, outside the tests."""
+    for frame in reversed(traceback.extract_stack()[:-2]):
+        if frame.filename.startswith(APP_DIR) and not frame.filename.startswith(TESTS_DIR):
+            return "{}:{} in {}".format(
+                os.path.relpath(frame.filename, os.path.dirname(APP_DIR)),
+                frame.lineno,
+                frame.name,
+                )
+    return "outside the application"
+
+
+class QueryGuard:
+    """Execute wrapper recording the queries of a request."""
+
+    def __init__(self, max_queries=MAX_QUERIES, max_repeats=MAX_REPEATS,
+                 slow_query_ms=SLOW_QUERY_MS):
+        self.max_queries = max_queries
+        self.max_repeats = max_repeats
+        self.slow_query_ms = slow_query_ms
+        self.count = 0
+        self.shapes = OrderedDict()
+        self.slow = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            self.count += 1
+            site = call_site()
+            sites = self.shapes.setdefault(query_shape(sql), [])
+            sites.append(site)
+            if self.slow_query_ms is not None and duration > self.slow_query_ms:
+                self.slow.append((duration, sql, site))
+
+    def problems(self):
+        problems = []
+        if self.max_queries is not None and self.count > self.max_queries:
+            problems.append("{} queries, more than {}:".format(self.count, self.max_queries))
+            for shape, sites in self.shapes.items():
+                problems.append("  {} x {}\n    from {}".format(
+                    len(sites), shape, ", ".join(OrderedDict.fromkeys(sites))
+                    ))
+        for shape, sites in self.shapes.items():
+            if len(sites) > self.max_repeats:
+                problems.append(
+                    "Query repeated {} times, more than {}:\n  {}\n  from {}".format(
+                        len(sites), self.max_repeats, shape,
+                        ", ".join(OrderedDict.fromkeys(sites))
+                        )
+                    )
+        for duration, sql, site in self.slow:
+            problems.append("Slow query, {:.0f} ms:\n  {}\n  from {}".format(duration, sql, site))
+        return problems
+
+
+class GuardedClient(Client):
+    """Test client failing the requests which trip the query guard."""
+
+    max_queries = MAX_QUERIES
+    max_repeats = MAX_REPEATS
+    slow_query_ms = SLOW_QUERY_MS
+
+    def request(self, **request):
+        guard = QueryGuard(self.max_queries, self.max_repeats, self.slow_query_ms)
+        with connection.execute_wrapper(guard):
+            response = super().request(**request)
+        problems = guard.problems()
+        if problems:
+            raise AssertionError("{} {}\n{}".format(
+                request.get('REQUEST_METHOD', 'GET'),
+                request.get('PATH_INFO', ''),
+                "\n".join(problems)
+                ))
+        return response
+
+
+class QueryGuardTestCase(TestCase):
+    """TestCase whose client is guarded, limits can be set per class."""
+
+    client_class = GuardedClient
+    max_queries = MAX_QUERIES
+    max_repeats = MAX_REPEATS
+    slow_query_ms = SLOW_QUERY_MS
+
+    def _pre_setup(self):
+        super()._pre_setup()
+        self.client.max_queries = self.max_queries
+        self.client.max_repeats = self.max_repeats
+        self.client.slow_query_ms = self.slow_query_ms
@@ -0,0 +1,79 @@
+from decimal import Decimal
+
+from django.test import TestCase
+from django.urls import reverse
+
+from openfoodfacts.cache import bump_catalogue_version
+from openfoodfacts.models import Categories, Products
+from openfoodfacts.substitutes import rebuild_substitutes
+
+
+class ApiTestCase(TestCase):
+    def setUp(self):
+        category = Categories.objects.create(category_name="en:spreads")
+        products = [
+            (1, "nutella", "e"),
+            (2, "Nutella B-ready", "d"),
+            (3, "Pâte de noisettes", "a"),
+            ]
+        for id_product, name, nutriscore in products:
+            Products.objects.create(
+                id_product=id_product,
+                product_name=name,
+                category=category,
+                nutriscore=nutriscore,
+                salt=Decimal("0.1"),
+                )
+        rebuild_substitutes()
+        bump_catalogue_version()
+
+    def test_search(self):
+        response = self.client.get(reverse('openfoodfacts:api_products'), {'query': 'nutella'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {product['id_product'] for product in response.json()['products']},
+            {1, 2}
+            )
+
+    def test_search_requires_query(self):
+        response = self.client.get(reverse('openfoodfacts:api_products'))
+        self.assertEqual(response.status_code, 400)
+
+    def test_field_selection(self):
+        url = reverse('openfoodfacts:api_product', args=(1,))
+        response = self.client.get(url, {'fields': 'product_name,category,salt_level'})
+        self.assertEqual(response.json(), {
+            'product_name': 'nutella',
+            'category': 'en:spreads',
+            'salt_level': 'low',
+            })
+        self.assertEqual(self.client.get(url, {'fields': 'password'}).status_code, 400)
+
+    def test_missing_product(self):
+        response = self.client.get(reverse('openfoodfacts:api_product', args=(4,)))
+        self.assertEqual(response.status_code, 404)
+
+    def test_substitutes(self):
+        response = self.client.get(reverse('openfoodfacts:api_substitutes', args=(1,)))
+        data = response.json()
+        self.assertEqual([product['id_product'] for product in data['substitutes']], [3, 2])
+        self.assertIsNone(data['next'])
+
+    def test_not_modified(self):
+        url = reverse('openfoodfacts:api_substitutes', args=(1,))
+        response = self.client.get(url)
+        self.assertTrue(response.has_header('Last-Modified'))
+        etag = response['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # a new import changes the representation
+        bump_catalogue_version()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_read_only(self):
+        response = self.client.post(reverse('openfoodfacts:api_product', args=(1,)))
+        self.assertEqual(response.status_code, 405)
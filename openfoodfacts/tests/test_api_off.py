@@ -1,8 +1,24 @@
+import gzip
 import json
+import os
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import StringIO
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
-from openfoodfacts.models import Categories, Products
+from openfoodfacts.cache import catalogue_version
+from openfoodfacts.models import Categories, Products, ProductSubstitutes, SyncCheckpoint
 from openfoodfacts.management.commands.api_off import Command
+from openfoodfacts.management.commands._private import ProductLoader, read_dump
+from openfoodfacts.nutrients import MODERATE
+from openfoodfacts.substitutes import rebuild_substitutes
+from django.db import IntegrityError, connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 
 
@@ -36,3 +52,361 @@ class CommandTestCase(TestCase):
 
         self.assertEqual(Products.objects.all().exists(), True)
         self.assertEqual(Categories.objects.all().exists(), True)
+
+    def test_insert_reports_counts(self):
+        self.com.loader = ProductLoader()
+        self.com._insert(self.content)
+        self.assertEqual(self.com.loader.inserted, 1)
+
+        self.content[0]["nutriscore"] = "b"
+        self.com._insert(self.content)
+        self.assertEqual(self.com.loader.updated, 1)
+        self.assertEqual(Products.objects.get(pk=123).nutriscore, "b")
+
+
+class ProductLoaderTestCase(TestCase):
+    def product(self, product_id, name, category="en:cheeses"):
+        return {
+            "product_name": name,
+            "product_id": product_id,
+            "product_url": "http://",
+            "product_img": "http://",
+            "nutriscore": "c",
+            "fat": 6.3,
+            "saturated_fat": "1",
+            "salt": "",
+            "sugar": 13,
+            "categories": [category]
+            }
+
+    def test_load_by_batches(self):
+        loader = ProductLoader(batch_size=10)
+        products = [self.product(i, "product {}".format(i)) for i in range(25)]
+        loader.load(products)
+
+        self.assertEqual(Products.objects.count(), 25)
+        self.assertEqual(Categories.objects.count(), 1)
+        self.assertEqual(loader.report(), "25 inserted, 0 updated, 0 unchanged, 0 skipped")
+
+    def test_load_converts_nutriments(self):
+        ProductLoader().load([self.product(1, "Comté")])
+        product = Products.objects.get(pk=1)
+        self.assertEqual(product.saturated_fat, Decimal("1.00"))
+        self.assertIsNone(product.salt)
+        self.assertEqual(product.fat_level, MODERATE)
+        self.assertIsNone(product.salt_level)
+
+    def test_load_skips_duplicates(self):
+        Products.objects.create(
+            id_product=1,
+            product_name="Comté",
+            category=Categories.objects.create(category_name="Fromages")
+            )
+        loader = ProductLoader()
+        loader.load([
+            self.product(2, "Comté"),
+            self.product(3, "Brie"),
+            self.product(3, "Brie de Meaux"),
+            ])
+
+        self.assertEqual(loader.report(), "1 inserted, 0 updated, 0 unchanged, 2 skipped")
+        self.assertEqual(Products.objects.get(pk=3).product_name, "Brie")
+
+    def test_load_leaves_unchanged_products(self):
+        ProductLoader().load([self.product(1, "Comté"), self.product(2, "Brie")])
+        Products.objects.filter(pk=1).update(url="http://stale")
+
+        loader = ProductLoader()
+        brie = dict(self.product(2, "Brie"), nutriscore="d")
+        loader.load([self.product(1, "Comté"), brie])
+
+        self.assertEqual(loader.report(), "0 inserted, 1 updated, 1 unchanged, 0 skipped")
+        self.assertEqual(Products.objects.get(pk=1).url, "http://stale")
+        self.assertEqual(Products.objects.get(pk=2).nutriscore, "d")
+
+    def test_failed_batch_is_not_counted_twice(self):
+        ProductLoader().load([self.product(1, "Comté")])
+        write = ProductLoader._write
+
+        def fail_on_bad_row(loader, rows):
+            counts = write(loader, rows)
+            if any(row["id_product"] == 3 for row in rows):
+                raise IntegrityError("bad row")
+            return counts
+
+        loader = ProductLoader()
+        with mock.patch.object(ProductLoader, '_write', fail_on_bad_row):
+            loader.load([
+                dict(self.product(1, "Comté"), nutriscore="d"),
+                self.product(2, "Brie"),
+                self.product(3, "Bad"),
+                ])
+
+        self.assertEqual(loader.report(), "1 inserted, 1 updated, 0 unchanged, 1 skipped")
+        self.assertFalse(Products.objects.filter(pk=3).exists())
+
+    def test_load_builds_category_tree(self):
+        spread = dict(self.product(1, "Nutella"), categories=["en:spreads", "en:sweet-spreads"])
+        honey = dict(self.product(2, "Miel"), categories=["en:spreads", "en:honeys"])
+        ProductLoader().load([spread, honey, dict(self.product(3, "Eau"), categories=[])])
+
+        sweet = Categories.objects.get(category_name="en:sweet-spreads")
+        self.assertEqual(sweet.parent.category_name, "en:spreads")
+        self.assertIsNone(sweet.parent.parent)
+        self.assertEqual(sweet.label, "Sweet spreads")
+        self.assertEqual(Products.objects.get(pk=1).category, sweet)
+        self.assertEqual(Categories.objects.get(category_name="en:spreads").children.count(), 2)
+        self.assertEqual(Products.objects.get(pk=3).category.category_name, "en:unknown")
+
+    def test_category_keeps_its_first_parent(self):
+        spread = dict(self.product(1, "Nutella"), categories=["en:spreads", "en:sweet-spreads"])
+        moved = dict(self.product(2, "Miel"), categories=["en:sweets", "en:sweet-spreads"])
+        other = dict(self.product(3, "Confiture"), categories=["en:sweets", "en:sweet-spreads"])
+        loader = ProductLoader(batch_size=1)
+        loader.load([spread])
+        with self.assertLogs("openfoodfacts.management.commands._private", "WARNING") as logs:
+            loader.load([moved, other])
+
+        sweet = Categories.objects.get(category_name="en:sweet-spreads")
+        self.assertEqual(sweet.parent.category_name, "en:spreads")
+        self.assertEqual(Products.objects.get(pk=2).category, sweet)
+        # logged once per category
+        self.assertEqual(logs.output, [
+            "WARNING:openfoodfacts.management.commands._private:"
+            "Category en:sweet-spreads is below en:spreads, not below en:sweets."
+            ])
+
+    def test_batch_query_count_is_constant(self):
+        Categories.objects.create(category_name="en:cheeses")
+        counts = []
+        for size in (10, 50):
+            products = [
+                self.product(size * 1000 + i, "product {} {}".format(size, i))
+                for i in range(size)
+                ]
+            with CaptureQueriesContext(connection) as queries:
+                ProductLoader(batch_size=size).load(products)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answer OpenFoodFacts searches with the recorded search.json."""
+
+    def do_GET(self):
+        server = self.server
+        params = parse_qs(urlparse(self.path).query)
+        server.categories.append(params["tag_0"][0])
+        if server.failures:
+            server.failures -= 1
+            self.send_response(503)
+            self.end_headers()
+            return
+        time.sleep(server.delay)
+
+        with open("openfoodfacts/tests/mock_folder/search.json") as results:
+            results = json.load(results)
+        page = int(params["page"][0])
+        size = int(params["page_size"][0])
+        server.pages.append(page)
+        results["page"] = page
+        results["page_size"] = size
+        results["products"] = results["products"][(page - 1) * size:page * size]
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        try:
+            self.wfile.write(json.dumps(results).encode())
+        except BrokenPipeError:
+            # the client gave up waiting
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class FetchTestCase(TestCase):
+    """Run the command against a local stub of the OpenFoodFacts API."""
+
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.categories = []
+        self.server.pages = []
+        self.server.failures = 0
+        self.server.delay = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.com = Command(stdout=StringIO(), stderr=StringIO())
+        self.com.api_url = "http://127.0.0.1:{}/cgi/search.pl".format(
+            self.server.server_port
+            )
+        self.com.categories = ["Fromages", "Confiseries", "Gateaux"]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_fetch_categories_concurrently(self):
+        self.com.handle(workers=3)
+
+        self.assertEqual(sorted(self.server.categories), sorted(self.com.categories))
+        self.assertEqual(Products.objects.count(), 2)
+        self.assertIn("2 inserted, 0 updated, 4 unchanged", self.com.stdout.getvalue())
+
+    def test_fetch_retries_server_errors(self):
+        self.server.failures = 2
+        self.com.categories = ["Fromages"]
+        self.com.handle(retries=2)
+
+        self.assertEqual(len(self.server.categories), 3)
+        self.assertEqual(Products.objects.count(), 2)
+
+    def test_fetch_timeout(self):
+        self.server.delay = 0.5
+        self.com.categories = ["Fromages"]
+        self.com.handle(timeout=0.1, retries=0)
+
+        self.assertFalse(Products.objects.exists())
+        self.assertIn("Fromages", self.com.stderr.getvalue())
+
+    def test_fetch_first_page_only(self):
+        self.com.categories = ["Fromages"]
+        self.com.handle(page_size=1)
+
+        self.assertEqual(self.server.pages, [1])
+        self.assertEqual(Products.objects.count(), 1)
+
+    def test_fetch_incremental(self):
+        SyncCheckpoint.objects.create(source="api", last_modified_t=1525000000)
+        self.com.categories = ["Fromages"]
+        self.com.handle(incremental=True, page_size=1)
+
+        # products come most recent first, the second page reaches the checkpoint
+        self.assertEqual(self.server.pages, [1, 2])
+        self.assertEqual(Products.objects.count(), 1)
+        self.assertEqual(
+            SyncCheckpoint.objects.get(source="api").last_modified_t,
+            1530000000
+            )
+
+    def test_failed_fetch_keeps_checkpoint(self):
+        SyncCheckpoint.objects.create(source="api", last_modified_t=1500000000)
+        self.server.failures = 1
+        self.com.categories = ["Fromages", "Gateaux"]
+        self.com.handle(incremental=True, retries=0)
+
+        self.assertEqual(
+            SyncCheckpoint.objects.get(source="api").last_modified_t,
+            1500000000
+            )
+
+    def test_fetch_all_pages(self):
+        self.com.categories = ["Fromages", "Gateaux"]
+        self.com.handle(all_pages=True, page_size=1)
+
+        self.assertEqual(sorted(self.server.pages), [1, 1, 2, 2, 3, 3])
+        self.assertEqual(Products.objects.count(), 2)
+
+
+class DumpTestCase(TestCase):
+    def setUp(self):
+        with open("openfoodfacts/tests/mock_folder/search.json") as results:
+            self.products = json.load(results)["products"]
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_dump(self, name, opener=open):
+        path = os.path.join(self.directory.name, name)
+        with opener(path, "wt", encoding="utf-8") as dump:
+            for product in self.products:
+                dump.write(json.dumps(product) + "\n")
+            dump.write("not json\n")
+        return path
+
+    def test_read_dump(self):
+        path = self.write_dump("products.jsonl")
+        self.assertEqual(list(read_dump(path)), self.products)
+
+    def test_import_gzipped_dump(self):
+        path = self.write_dump("products.jsonl.gz", opener=gzip.open)
+        com = Command(stdout=StringIO(), stderr=StringIO())
+        com.handle(dump=path, batch_size=1)
+
+        self.assertEqual(Products.objects.count(), 2)
+        self.assertIn("2 inserted", com.stdout.getvalue())
+        self.assertEqual(catalogue_version(), 1)
+
+    def test_incremental_import(self):
+        path = self.write_dump("products.jsonl")
+        Command(stdout=StringIO()).handle(dump=path)
+        self.assertEqual(
+            SyncCheckpoint.objects.get(source="dump").last_modified_t,
+            1530000000
+            )
+
+        # only Nutella changed upstream since the checkpoint
+        self.products[1]["last_modified_t"] = 1540000000
+        self.products[1]["nutrition_grades_tags"] = ["d"]
+        path = self.write_dump("products.jsonl")
+        com = Command(stdout=StringIO())
+        com.handle(dump=path, incremental=True)
+
+        self.assertIn("0 inserted, 1 updated, 0 unchanged", com.stdout.getvalue())
+        self.assertEqual(Products.objects.get(product_name="Nutella").nutriscore, "d")
+        self.assertEqual(
+            SyncCheckpoint.objects.get(source="dump").last_modified_t,
+            1540000000
+            )
+
+    def test_incremental_import_ranks_only_the_changed_families(self):
+        path = self.write_dump("products.jsonl")
+        Command(stdout=StringIO()).handle(dump=path)
+        cheeses = Categories.objects.create(category_name="en:cheeses")
+        for id_product, name, nutriscore in [(10, "Comté", "c"), (11, "Brie", "d")]:
+            Products.objects.create(
+                id_product=id_product, product_name=name, category=cheeses, nutriscore=nutriscore
+                )
+        Products.objects.create(
+            id_product=12, product_name="Nocciolata", nutriscore="c",
+            category=Products.objects.get(product_name="Nutella").category
+            )
+        rebuild_substitutes()
+        cheese_rows = list(ProductSubstitutes.objects.filter(
+            origin__category=cheeses
+            ).values_list("pk", "origin", "replacement", "rank"))
+        nutella_rows = set(ProductSubstitutes.objects.filter(
+            origin__product_name="Nutella"
+            ).values_list("pk", flat=True))
+        self.assertTrue(cheese_rows)
+        self.assertTrue(nutella_rows)
+
+        self.products[1]["last_modified_t"] = 1540000000
+        self.products[1]["nutrition_grades_tags"] = ["d"]
+        path = self.write_dump("products.jsonl")
+        Command(stdout=StringIO()).handle(dump=path, incremental=True)
+
+        self.assertEqual(
+            list(ProductSubstitutes.objects.filter(
+                origin__category=cheeses
+                ).values_list("pk", "origin", "replacement", "rank")),
+            cheese_rows
+            )
+        # the family of Nutella was ranked again
+        self.assertFalse(nutella_rows & set(ProductSubstitutes.objects.filter(
+            origin__product_name="Nutella"
+            ).values_list("pk", flat=True)))
+
+    def test_profile(self):
+        path = self.write_dump("products.jsonl")
+        com = Command(stdout=StringIO(), stderr=StringIO())
+        com.handle(dump=path, profile=True)
+
+        output = com.stdout.getvalue()
+        for stage in ("parse", "transform", "write", "substitutes"):
+            self.assertIn(stage, com.timer.stages)
+            self.assertIn(stage, output)
+        self.assertIn("2 rows in", output)
+        self.assertIn("rows/s", output)
@@ -0,0 +1,83 @@
+import threading
+from unittest import mock
+
+from django.test import TestCase
+from django.urls import reverse
+
+from openfoodfacts.autocomplete import Autocomplete, PrefixIndex, normalize, product_names
+from openfoodfacts.cache import bump_catalogue_version
+from openfoodfacts.models import Categories, Products
+
+
+class PrefixIndexTestCase(TestCase):
+    def setUp(self):
+        self.index = PrefixIndex([
+            (1, "Nutella"),
+            (2, "Pâte de noisettes"),
+            (3, "Pâte à tartiner"),
+            (4, "Nutella B-ready"),
+            ])
+
+    def names(self, prefix, limit=10):
+        return [p["product_name"] for p in self.index.search(prefix, limit)]
+
+    def test_normalize(self):
+        self.assertEqual(normalize(" Pâte à  TARTINER "), "pate a tartiner")
+
+    def test_search_name_prefix(self):
+        self.assertEqual(self.names("nut"), ["Nutella", "Nutella B-ready"])
+        self.assertEqual(self.names("pate a"), ["Pâte à tartiner"])
+
+    def test_search_word_prefix(self):
+        self.assertEqual(self.names("noisette"), ["Pâte de noisettes"])
+
+    def test_search_limit(self):
+        self.assertEqual(self.names("p", limit=1), ["Pâte à tartiner"])
+        self.assertEqual(self.names(" "), [])
+
+
+class AutocompleteTestCase(TestCase):
+    def setUp(self):
+        self.category = Categories.objects.create(category_name="en:spreads")
+        Products.objects.create(id_product=1, product_name="Nutella", category=self.category)
+        product_names._index = None
+
+    def test_endpoint_does_not_query(self):
+        url = reverse('openfoodfacts:autocomplete')
+        self.client.get(url, {'q': 'nut'})
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'q': 'nut'})
+        self.assertEqual(response.json()['products'], [
+            {'id_product': 1, 'product_name': 'Nutella'},
+            ])
+
+    def test_rebuilt_on_new_catalogue(self):
+        names = Autocomplete(refresh=0, background=False)
+        self.assertEqual(len(names.search("noc")), 0)
+        Products.objects.create(id_product=2, product_name="Nocciolata", category=self.category)
+        self.assertEqual(len(names.search("noc")), 0)
+
+        bump_catalogue_version()
+        self.assertEqual(len(names.search("noc")), 1)
+
+    def test_current_index_is_served_during_a_check(self):
+        names = Autocomplete(refresh=0)
+        current = names.index()
+        started = threading.Event()
+        release = threading.Event()
+        checks = []
+
+        def slow_check():
+            checks.append(threading.current_thread())
+            started.set()
+            release.wait(5)
+
+        with mock.patch.object(names, '_check', slow_check):
+            self.assertIs(names.index(), current)
+            self.assertTrue(started.wait(5))
+            # the check runs in another thread, no second one is started
+            self.assertIs(names.index(), current)
+            release.set()
+            self.assertTrue(names._checking.acquire(timeout=5))
+        self.assertEqual(len(checks), 1)
+        self.assertIsNot(checks[0], threading.current_thread())
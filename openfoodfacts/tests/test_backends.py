@@ -0,0 +1,62 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from openfoodfacts.backends import user_key
+from openfoodfacts.models import User
+
+
+class SessionSettingsTestCase(TestCase):
+    def test_local_cache_keeps_sessions_in_database(self):
+        # the tests run with the local memory cache, not shared by the workers
+        self.assertNotIn(settings.CACHES['default']['BACKEND'], settings.SHARED_CACHE_BACKENDS)
+        self.assertEqual(settings.SESSION_ENGINE, 'django.contrib.sessions.backends.db')
+        self.assertEqual(
+            settings.AUTHENTICATION_BACKENDS, ['django.contrib.auth.backends.ModelBackend']
+            )
+
+
+# within one test process the local memory cache acts as a shared one
+@override_settings(
+    SESSION_ENGINE='django.contrib.sessions.backends.cached_db',
+    AUTHENTICATION_BACKENDS=['openfoodfacts.backends.CachedModelBackend'],
+    )
+class CachedIdentityTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="david", password="purbeurre")
+        self.client.login(username="david", password="purbeurre")
+        self.url = reverse('openfoodfacts:account')
+
+    def test_identity_costs_no_query(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.context["user"], self.user)
+
+    def test_saved_user_is_evicted(self):
+        self.client.get(self.url)
+        self.user.email = "david@purbeurre.fr"
+        self.user.save()
+        self.assertIsNone(cache.get(user_key(self.user.pk)))
+        self.assertEqual(self.client.get(self.url).context["user"].email, "david@purbeurre.fr")
+
+    def test_password_change_ends_sessions(self):
+        self.client.get(self.url)
+        self.user.set_password("new password")
+        self.user.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+        self.assertIn("login", response.url)
+
+    def test_clearsessions_removes_expired_rows(self):
+        Session.objects.update(expire_date=timezone.now() - timedelta(days=1))
+        call_command('clearsessions', stdout=StringIO())
+        self.assertFalse(Session.objects.exists())
@@ -0,0 +1,59 @@
+import os
+import tempfile
+
+from django.test import TestCase
+
+from openfoodfacts.management.commands._benchmark import (
+    measure, percentile, seed_catalogue, seed_user, write_dump
+)
+from openfoodfacts.management.commands._private import extract_product, read_dump
+from openfoodfacts.models import Categories, Products, ProductSubstitutes, Substitutes
+
+
+class BenchmarkTestCase(TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([3], 95), 3)
+        self.assertIsNone(percentile([], 50))
+
+    def test_seed_catalogue(self):
+        ids = seed_catalogue(1200)
+        self.assertEqual(Products.objects.count(), 1200)
+        # 3 leaf categories below their kind of product and its root
+        self.assertEqual(Categories.objects.filter(children__isnull=True).count(), 3)
+        self.assertEqual(Categories.objects.filter(parent__parent__isnull=False).count(), 3)
+        self.assertTrue(ProductSubstitutes.objects.exists())
+        self.assertFalse(Products.objects.filter(fat_level__isnull=True).exists())
+
+        seed_user(ids, saved=5)
+        self.assertEqual(Substitutes.objects.count(), 5)
+
+    def test_seed_catalogue_without_substitutes(self):
+        seed_catalogue(100, substitutes=False)
+        self.assertEqual(Products.objects.count(), 100)
+        self.assertFalse(ProductSubstitutes.objects.exists())
+
+    def test_measure(self):
+        seed_catalogue(20)
+        result = measure(self.client.get, ["/openfoodfacts/1/", "/openfoodfacts/2/"])
+        self.assertEqual(result["requests"], 2)
+        self.assertGreater(result["queries"], 0)
+        self.assertLessEqual(result["p50_ms"], result["p99_ms"])
+
+    def test_write_dump(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = write_dump(os.path.join(directory, "products.jsonl.gz"), 30)
+            products = [extract_product(product) for product in read_dump(path)]
+        self.assertEqual(len(products), 30)
+        self.assertEqual(len({product["product_id"] for product in products}), 30)
+        self.assertTrue(all(len(product["categories"]) == 3 for product in products))
+
+    def test_measure_concurrently(self):
+        class Response:
+            status_code = 200
+
+        result = measure(lambda path: Response(), ["/"] * 20, concurrency=4)
+        self.assertEqual(result["requests"], 20)
+        self.assertIsNone(result["queries"])
@@ -0,0 +1,109 @@
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.test import TestCase, override_settings
+from django.urls import path, reverse
+
+from openfoodfacts.cache import bump_catalogue_version, cache_anonymous, catalogue_version
+from openfoodfacts.models import Categories, Products, User
+
+
+class PageCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Categories.objects.create(category_name="Pâte à tartiner")
+        Products.objects.create(
+            id_product=1,
+            product_name="nutella",
+            category=category,
+            nutriscore="e"
+            )
+        self.url = reverse('openfoodfacts:detail', args=(1,))
+
+    def rename(self, name):
+        Products.objects.filter(pk=1).update(product_name=name)
+
+    def test_anonymous_page_is_cached(self):
+        self.client.get(self.url)
+        self.rename("Nutella B-ready")
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertContains(response, "nutella")
+
+    def test_bump_invalidates_pages(self):
+        self.client.get(self.url)
+        self.rename("Nutella B-ready")
+        bump_catalogue_version()
+        self.assertContains(self.client.get(self.url), "Nutella B-ready")
+
+    def test_authenticated_page_is_not_cached(self):
+        self.client.get(self.url)
+        self.rename("Nutella B-ready")
+        self.client.force_login(User.objects.create_user(username="david", password="purbeurre"))
+        self.assertContains(self.client.get(self.url), "Nutella B-ready")
+
+    def test_missing_page_is_not_cached(self):
+        url = reverse('openfoodfacts:detail', args=(2,))
+        self.assertEqual(self.client.get(url).status_code, 404)
+        Products.objects.create(
+            id_product=2,
+            product_name="Nocciolata",
+            category=Categories.objects.get(),
+            )
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_product_cards_are_cached(self):
+        url = reverse('openfoodfacts:products_list')
+        self.client.force_login(User.objects.create_user(username="david", password="purbeurre"))
+        self.client.get(url, {'query': 'nutella'})
+        self.rename("nutella B-ready")
+        self.assertNotContains(self.client.get(url, {'query': 'nutella'}), "B-ready")
+
+        bump_catalogue_version()
+        self.assertContains(self.client.get(url, {'query': 'nutella'}), "B-ready")
+
+    def test_build_substitutes_bumps_version(self):
+        version = catalogue_version()
+        call_command('build_substitutes', stdout=StringIO())
+        self.assertEqual(catalogue_version(), version + 1)
+
+
+@cache_anonymous
+def session_view(request):
+    request.session["seen"] = request.session.get("seen", 0) + 1
+    return HttpResponse(str(request.session["seen"]))
+
+
+@cache_anonymous
+def csrf_view(request):
+    return HttpResponse(get_token(request))
+
+
+urlpatterns = [
+    path('session/', session_view),
+    path('csrf/', csrf_view),
+    ]
+
+
+@override_settings(ROOT_URLCONF='openfoodfacts.tests.test_cache')
+class MiddlewareCacheTestCase(TestCase):
+    """Responses are stored once the middlewares added their cookies."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_session_page_is_not_cached(self):
+        self.assertEqual(self.client.get('/session/').content, b"1")
+        self.assertEqual(self.client.get('/session/').content, b"2")
+        # a new visitor is not served the page of the first one
+        self.client.cookies.clear()
+        self.assertEqual(self.client.get('/session/').content, b"1")
+
+    def test_csrf_page_is_not_cached(self):
+        response = self.client.get('/csrf/')
+        self.assertIn('csrftoken', response.cookies)
+        self.client.cookies.clear()
+        self.assertNotEqual(self.client.get('/csrf/').content, response.content)
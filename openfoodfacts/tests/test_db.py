@@ -0,0 +1,62 @@
+from unittest import mock
+
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from openfoodfacts import db
+from openfoodfacts.models import User
+
+
+class HealthCheckTestCase(TransactionTestCase):
+    def setUp(self):
+        db.stats.reset()
+        connection.ensure_connection()
+        db._last_used.aliases = {}
+
+    def test_dead_connection_is_closed(self):
+        with mock.patch.object(connection, 'is_usable', return_value=False), \
+                mock.patch.object(connection, 'close') as close:
+            db.check_connections()
+        close.assert_called_once_with()
+        self.assertEqual(db.stats.snapshot()['unusable'], 1)
+
+    def test_live_connection_is_kept(self):
+        with mock.patch.object(connection, 'close') as close:
+            db.check_connections()
+        close.assert_not_called()
+
+    @override_settings(DATABASE_HEALTH_CHECK_IDLE=60)
+    def test_recently_used_connection_is_not_checked(self):
+        db.mark_used()
+        with mock.patch.object(connection, 'is_usable') as is_usable:
+            db.check_connections()
+        is_usable.assert_not_called()
+
+    @override_settings(DATABASE_HEALTH_CHECK_IDLE=0)
+    def test_idle_connection_is_checked(self):
+        db.mark_used()
+        with mock.patch.object(connection, 'is_usable', return_value=True) as is_usable:
+            db.check_connections()
+        is_usable.assert_called_once_with()
+
+
+class ConnectionStatsTestCase(TestCase):
+    def setUp(self):
+        db.stats.reset()
+
+    def test_reuse_ratio(self):
+        self.assertIsNone(db.stats.snapshot()['reuse_ratio'])
+        for i in range(4):
+            db.check_connections()
+        connection_created.send(sender=connection.__class__, connection=connection)
+        snapshot = db.stats.snapshot()
+        self.assertEqual((snapshot['requests'], snapshot['opened']), (4, 1))
+        self.assertEqual(snapshot['reuse_ratio'], 0.75)
+
+    def test_metrics_endpoint(self):
+        staff = User.objects.create_user(username="admin", password="purbeurre", is_staff=True)
+        self.client.force_login(staff)
+        connections = self.client.get(reverse('openfoodfacts:metrics')).json()['connections']
+        self.assertEqual(connections['requests'], 1)
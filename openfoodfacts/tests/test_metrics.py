@@ -0,0 +1,51 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from openfoodfacts.metrics import Registry, registry
+from openfoodfacts.models import Categories, Products, User
+
+
+class RequestMetricsTestCase(TestCase):
+    def setUp(self):
+        registry.reset()
+        cache.clear()
+        category = Categories.objects.create(category_name="en:spreads")
+        Products.objects.create(id_product=1, product_name="nutella", category=category)
+        self.url = reverse('openfoodfacts:detail', args=(1,))
+
+    @override_settings(METRICS_SAMPLE_RATE=1)
+    def test_sampled_request(self):
+        response = self.client.get(self.url)
+        self.assertIn('queries", app;dur=', response['Server-Timing'])
+
+        stats = registry.snapshot()['views']['openfoodfacts:detail']
+        self.assertEqual(stats['requests'], 1)
+        self.assertGreater(stats['avg_queries'], 0)
+        self.assertEqual(stats['avg_bytes'], len(response.content))
+
+    @override_settings(METRICS_SAMPLE_RATE=0)
+    def test_unsampled_request(self):
+        response = self.client.get(self.url)
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(registry.snapshot()['views'], {})
+
+    def test_log(self):
+        metrics = Registry(log_interval=0)
+        with self.assertLogs('openfoodfacts.metrics', level='INFO') as logs:
+            metrics.record('openfoodfacts:search', 0.012, 4, 0.003, 2048)
+        self.assertEqual(logs.output, [
+            "INFO:openfoodfacts.metrics:view=openfoodfacts:search requests=1 avg_ms=12.0 "
+            "max_ms=12.0 avg_queries=4.0 avg_db_ms=3.0 avg_bytes=2048"
+            ])
+
+    @override_settings(METRICS_SAMPLE_RATE=1)
+    def test_stats_endpoint_is_staff_only(self):
+        url = reverse('openfoodfacts:metrics')
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        staff = User.objects.create_user(username="admin", password="purbeurre", is_staff=True)
+        self.client.force_login(staff)
+        self.client.get(self.url)
+        views = self.client.get(url).json()['views']
+        self.assertIn('openfoodfacts:detail', views)
@@ -0,0 +1,77 @@
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from openfoodfacts.models import Categories, Products
+from openfoodfacts.nutrients import (
+    HIGH, LOW, MODERATE, level_image, nutrient_level, update_levels
+)
+
+
+class NutrientLevelTestCase(TestCase):
+    def test_thresholds(self):
+        self.assertEqual(nutrient_level("salt", Decimal("0.29")), LOW)
+        self.assertEqual(nutrient_level("salt", Decimal("0.3")), MODERATE)
+        self.assertEqual(nutrient_level("salt", Decimal("1.5")), MODERATE)
+        self.assertEqual(nutrient_level("salt", Decimal("1.51")), HIGH)
+        self.assertEqual(nutrient_level("sugar", Decimal("12.5")), MODERATE)
+        self.assertIsNone(nutrient_level("fat", None))
+
+    def test_level_image(self):
+        self.assertEqual(
+            level_image(LOW),
+            "https://static.openfoodfacts.org/images/misc/low_30.png"
+            )
+        self.assertEqual(level_image(None), "")
+
+
+class ProductLevelsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Categories.objects.create(category_name="Pâte à tartiner")
+        Products.objects.create(
+            id_product=1,
+            product_name="nutella",
+            category=self.category,
+            fat=Decimal("30.9"),
+            saturated_fat=Decimal("10.6"),
+            salt=Decimal("0.107"),
+            sugar=Decimal("56.3"),
+            )
+
+    def test_save_computes_levels(self):
+        product = Products.objects.get(pk=1)
+        self.assertEqual(product.fat_level, HIGH)
+        self.assertEqual(product.salt_level, LOW)
+
+    def test_update_levels_matches_nutrient_level(self):
+        quantities = ["-1", "0", "0.3", "1", "1.5", "4", "5", "12.5", "20", "25"]
+        for i, quantity in enumerate(quantities, start=2):
+            Products.objects.create(
+                id_product=i,
+                product_name=str(i),
+                category=self.category,
+                fat=Decimal(quantity),
+                saturated_fat=Decimal(quantity),
+                salt=Decimal(quantity),
+                )
+        Products.objects.update(fat_level=None, saturated_fat_level=None, salt_level=None)
+
+        update_levels(Products.objects.all())
+        for product in Products.objects.all():
+            for nutrient in ("fat", "saturated_fat", "salt", "sugar"):
+                self.assertEqual(
+                    getattr(product, nutrient + "_level"),
+                    nutrient_level(nutrient, getattr(product, nutrient)),
+                    )
+
+    def test_filter_on_levels(self):
+        self.assertTrue(Products.objects.filter(salt_level=LOW).exists())
+        self.assertFalse(Products.objects.filter(sugar_level=LOW).exists())
+
+    def test_detail_page_shows_levels(self):
+        response = self.client.get(reverse('openfoodfacts:detail', args=(1,)))
+        self.assertEqual(response.context["fat_index_img"], level_image(HIGH))
+        self.assertEqual(response.context["salt_index_img"], level_image(LOW))
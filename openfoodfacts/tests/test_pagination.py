@@ -0,0 +1,67 @@
+from django.test import TestCase
+
+from openfoodfacts.models import Categories, Products
+from openfoodfacts.pagination import (
+    KeysetPaginator, NEXT, decode_cursor, encode_cursor
+    )
+
+
+class KeysetPaginatorTestCase(TestCase):
+    def setUp(self):
+        category = Categories.objects.create(category_name="Fromages")
+        for i in range(1, 21):
+            Products.objects.create(
+                id_product=i,
+                product_name="fromage {}".format(i),
+                category=category
+                )
+        self.paginator = KeysetPaginator(Products.objects.all(), 9)
+
+    def ids(self, page):
+        return [p.id_product for p in page]
+
+    def test_walk_forward_and_backward(self):
+        first = self.paginator.page()
+        self.assertEqual(self.ids(first), list(range(1, 10)))
+        self.assertFalse(first.has_previous())
+
+        second = self.paginator.page(first.next_cursor)
+        self.assertEqual(self.ids(second), list(range(10, 19)))
+
+        last = self.paginator.page(second.next_cursor)
+        self.assertEqual(self.ids(last), [19, 20])
+        self.assertFalse(last.has_next())
+
+        back = self.paginator.page(last.previous_cursor)
+        self.assertEqual(self.ids(back), list(range(10, 19)))
+        back = self.paginator.page(back.previous_cursor)
+        self.assertEqual(self.ids(back), list(range(1, 10)))
+        self.assertFalse(back.has_previous())
+        self.assertTrue(back.has_next())
+
+    def test_page_cost_is_constant(self):
+        page = self.paginator.page()
+        while page.has_next():
+            with self.assertNumQueries(1):
+                page = self.paginator.page(page.next_cursor)
+
+    def test_invalid_cursor_shows_first_page(self):
+        for cursor in ("garbage", encode_cursor("x", 3), "W251bGwsIG51bGxd"):
+            self.assertEqual(self.ids(self.paginator.page(cursor)), list(range(1, 10)))
+
+    def test_cursor_of_another_key_type_shows_first_page(self):
+        for key in ("abc", "", [1]):
+            page = self.paginator.page(encode_cursor(NEXT, key))
+            self.assertEqual(self.ids(page), list(range(1, 10)))
+
+    def test_emptied_page_shows_last_page(self):
+        page = self.paginator.page(encode_cursor(NEXT, 20))
+        self.assertEqual(self.ids(page), list(range(12, 21)))
+
+    def test_cursor_round_trip(self):
+        self.assertEqual(decode_cursor(encode_cursor(NEXT, 42)), (NEXT, 42))
+
+    def test_total(self):
+        paginator = KeysetPaginator(Products.objects.all(), 9, with_total=True)
+        self.assertGreater(paginator.page().total, 0)
+        self.assertIsNone(paginator.page(paginator.page().next_cursor).total)
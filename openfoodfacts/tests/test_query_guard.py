@@ -0,0 +1,44 @@
+from django.db import connection
+from django.test import TestCase
+from django.urls import reverse
+
+from openfoodfacts.models import Categories, Products
+from openfoodfacts.tests.query_guard import GuardedClient, QueryGuard, query_shape
+
+
+class QueryGuardReportTestCase(TestCase):
+    def setUp(self):
+        category = Categories.objects.create(category_name="en:spreads")
+        for i in range(1, 6):
+            Products.objects.create(id_product=i, product_name=str(i), category=category)
+
+    def test_query_shape(self):
+        self.assertEqual(
+            query_shape("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'a''b' LIMIT 21"),
+            "SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?"
+            )
+
+    def test_repeated_query(self):
+        guard = QueryGuard(max_queries=None, max_repeats=3)
+        with connection.execute_wrapper(guard):
+            for product in Products.objects.all():
+                product.category
+        problems = guard.problems()
+        self.assertEqual(len(problems), 1)
+        self.assertIn("Query repeated 5 times", problems[0])
+        self.assertIn("openfoodfacts_categories", problems[0])
+
+    def test_query_count(self):
+        guard = QueryGuard(max_queries=2, max_repeats=10)
+        with connection.execute_wrapper(guard):
+            for i in range(1, 4):
+                Products.objects.get(pk=i)
+        self.assertIn("3 queries, more than 2:", guard.problems())
+
+    def test_guarded_client_reports_call_site(self):
+        client = GuardedClient()
+        client.max_queries = 0
+        with self.assertRaises(AssertionError) as raised:
+            client.get(reverse('openfoodfacts:api_product', args=(1,)))
+        self.assertIn("GET /openfoodfacts/api/products/1/", str(raised.exception))
+        self.assertIn("openfoodfacts/", str(raised.exception))
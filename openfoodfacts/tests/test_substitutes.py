@@ -0,0 +1,170 @@
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipIf
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from openfoodfacts.models import Categories, Products, ProductSubstitutes
+from openfoodfacts import substitutes
+from openfoodfacts.substitutes import rebuild_substitutes, ranked_substitutes, ranking_categories
+
+
+class SubstitutesTestCase(TestCase):
+    def setUp(self):
+        self.spreads = Categories.objects.create(category_name="Pâte à tartiner")
+        self.cheeses = Categories.objects.create(category_name="Fromages")
+        products = [
+            (1, "nutella", self.spreads, "e"),
+            (2, "Nocciolata", self.spreads, "c"),
+            (3, "Pâte de noisettes", self.spreads, "a"),
+            (4, "Pâte aux amandes", self.spreads, "c"),
+            (5, "Comté", self.cheeses, "d"),
+            (6, "Brie", self.cheeses, "d"),
+            ]
+        for id_product, name, category, nutriscore in products:
+            Products.objects.create(
+                id_product=id_product,
+                product_name=name,
+                category=category,
+                nutriscore=nutriscore
+                )
+
+    def ranking(self, origin):
+        return [p.id_product for p in ranked_substitutes(origin)]
+
+    def test_rebuild_ranks_by_nutriscore(self):
+        rebuild_substitutes()
+        self.assertEqual(self.ranking(1), [3, 2, 4])
+        self.assertEqual(self.ranking(2), [3, 4])
+        self.assertEqual(self.ranking(3), [])
+        self.assertEqual(self.ranking(5), [6])
+
+    def test_rebuild_one_category(self):
+        rebuild_substitutes()
+        Products.objects.filter(pk=6).update(nutriscore="e")
+        Products.objects.filter(pk=4).update(nutriscore="a")
+
+        rebuild_substitutes([self.spreads.pk])
+        self.assertEqual(self.ranking(1), [3, 4, 2])
+        # cheeses are left as they were
+        self.assertEqual(self.ranking(5), [6])
+
+    def test_rebuild_includes_sibling_categories(self):
+        hazelnut = Categories.objects.create(category_name="Pâte à tartiner aux noisettes", parent=self.spreads)
+        honey = Categories.objects.create(category_name="Miel", parent=self.spreads)
+        Products.objects.create(id_product=7, product_name="Nutella bio", category=hazelnut, nutriscore="d")
+        Products.objects.create(id_product=8, product_name="Noisettes", category=hazelnut, nutriscore="e")
+        Products.objects.create(id_product=9, product_name="Miel", category=honey, nutriscore="b")
+
+        rebuild_substitutes()
+        # the own category comes first at equal score, but a much healthier
+        # product of the parent category beats a slightly healthier one
+        self.assertEqual(self.ranking(8), [3, 7, 9, 2, 4, 1])
+        # a root category takes its whole subtree
+        self.assertEqual(self.ranking(1), [3, 2, 4, 9, 7, 8])
+
+    def test_grandchildren_rank_in_their_own_family(self):
+        hazelnut = Categories.objects.create(category_name="Pâte à tartiner aux noisettes", parent=self.spreads)
+        organic = Categories.objects.create(category_name="Pâte à tartiner aux noisettes bio", parent=hazelnut)
+        Products.objects.create(id_product=7, product_name="Nutella bio", category=hazelnut, nutriscore="d")
+        Products.objects.create(id_product=8, product_name="Noisettes bio", category=organic, nutriscore="e")
+
+        rebuild_substitutes()
+        # the family of a product is its parent category and the children of it
+        self.assertEqual(self.ranking(8), [7])
+        self.assertEqual(self.ranking(1), [3, 2, 4, 7])
+
+    def test_ranking_categories(self):
+        hazelnut = Categories.objects.create(category_name="Pâte à tartiner aux noisettes", parent=self.spreads)
+        honey = Categories.objects.create(category_name="Miel", parent=self.spreads)
+        organic = Categories.objects.create(category_name="Pâte à tartiner aux noisettes bio", parent=hazelnut)
+
+        # siblings and the root parent rank honey, the grandchildren do not
+        self.assertEqual(
+            ranking_categories([honey.pk]), {self.spreads.pk, hazelnut.pk, honey.pk}
+            )
+        # hazelnut is also the family of its children
+        self.assertEqual(
+            ranking_categories([hazelnut.pk]),
+            {self.spreads.pk, hazelnut.pk, honey.pk, organic.pk}
+            )
+        self.assertEqual(ranking_categories([self.cheeses.pk]), {self.cheeses.pk})
+
+    def test_candidates_are_capped(self):
+        hazelnut = Categories.objects.create(category_name="Pâte à tartiner aux noisettes", parent=self.spreads)
+        honey = Categories.objects.create(category_name="Miel", parent=self.spreads)
+        Products.objects.create(id_product=7, product_name="Nutella bio", category=hazelnut, nutriscore="d")
+        Products.objects.create(id_product=8, product_name="Noisettes", category=hazelnut, nutriscore="e")
+        Products.objects.create(id_product=9, product_name="Miel", category=honey, nutriscore="b")
+
+        engines = [substitutes.numpy, None] if substitutes.numpy else [None]
+        for engine in engines:
+            with mock.patch.object(substitutes, 'numpy', engine), \
+                    mock.patch.object(substitutes, 'MAX_CANDIDATES', 4):
+                rebuild_substitutes()
+            # 7 and 8 of its own category, then the healthiest 3 and 9
+            self.assertEqual(self.ranking(8), [3, 7, 9])
+
+    def test_ranking_is_one_query(self):
+        rebuild_substitutes()
+        with self.assertNumQueries(1):
+            self.ranking(1)
+
+    def test_build_substitutes_command(self):
+        call_command('build_substitutes', category=["Fromages"], stdout=StringIO())
+        self.assertEqual(
+            set(ProductSubstitutes.objects.values_list('origin', flat=True)),
+            {5, 6}
+            )
+
+    def set_nutrients(self, id_product, fat, saturated_fat, salt, sugar):
+        Products.objects.filter(pk=id_product).update(
+            fat=Decimal(fat),
+            saturated_fat=Decimal(saturated_fat),
+            salt=Decimal(salt),
+            sugar=Decimal(sugar),
+            )
+
+    def test_closest_substitutes_first(self):
+        for id_product in (7, 8, 9):
+            Products.objects.create(
+                id_product=id_product,
+                product_name="Pâte {}".format(id_product),
+                category=self.spreads,
+                nutriscore="c"
+                )
+        self.set_nutrients(1, "31", "10.6", "0.1", "56")
+        self.set_nutrients(7, "30", "10", "0.1", "50")
+        self.set_nutrients(8, "5", "1", "0.1", "20")
+        self.set_nutrients(9, "30", "10", "1.2", "52")
+
+        rebuild_substitutes()
+        # the c products close to nutella beat the a product of unknown
+        # nutrients, the c product far from nutella comes last
+        self.assertEqual(self.ranking(1), [7, 9, 3, 2, 4, 8])
+
+    @skipIf(substitutes.numpy is None, "NumPy is not installed")
+    def test_sql_ranking_matches_arrays(self):
+        hazelnut = Categories.objects.create(category_name="Pâte à tartiner aux noisettes", parent=self.spreads)
+        for i in range(10, 40):
+            Products.objects.create(
+                id_product=i,
+                product_name="Pâte {}".format(i),
+                category=hazelnut if i % 3 else self.spreads,
+                nutriscore="abcde"[i % 5]
+                )
+            self.set_nutrients(i, i % 7 * 4, i % 4, i % 5 / 4, i % 11 * 3)
+
+        rebuild_substitutes()
+        arrays = list(ProductSubstitutes.objects.order_by('origin', 'rank').values_list(
+            'origin', 'replacement', 'rank'
+            ))
+        with mock.patch.object(substitutes, 'numpy', None):
+            rebuild_substitutes()
+        self.assertEqual(
+            arrays,
+            list(ProductSubstitutes.objects.order_by('origin', 'rank').values_list(
+                'origin', 'replacement', 'rank'
+                ))
+            )
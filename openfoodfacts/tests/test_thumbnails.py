@@ -0,0 +1,183 @@
+import io
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import StringIO
+from unittest import mock, skipUnless
+
+import requests
+
+from django.core.cache import cache
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+
+from openfoodfacts import thumbnails
+from openfoodfacts.management.commands.api_off import Command
+from openfoodfacts.models import Categories, Products
+
+with open("openfoodfacts/tests/mock_folder/product.jpg", "rb") as fixture:
+    IMAGE = fixture.read()
+
+
+def png_header(width, height):
+    """A PNG file of `width` x `height` pixels without any pixel data."""
+    def chunk(kind, data):
+        return (struct.pack(">I", len(data)) + kind + data
+                + struct.pack(">I", zlib.crc32(kind + data)))
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 1, 0, 0, 0, 0))
+            + chunk(b"IEND", b""))
+
+
+# Images served by ImageHandler, by path
+IMAGES = {
+    "/product.jpg": IMAGE,
+    # decoded, these would take gigabytes
+    "/bomb.png": png_header(50000, 50000),
+    "/huge.png": png_header(6000, 6000),
+}
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    """Serve the IMAGES, count the requests."""
+
+    def do_GET(self):
+        self.server.requests += 1
+        if self.path not in IMAGES:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(IMAGES[self.path])))
+        self.end_headers()
+        self.wfile.write(IMAGES[self.path])
+
+    def log_message(self, *args):
+        pass
+
+
+@skipUnless(thumbnails.enabled(), "Pillow with WebP support is not installed")
+class ThumbnailsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.server = HTTPServer(("127.0.0.1", 0), ImageHandler)
+        self.server.requests = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = "http://127.0.0.1:{}".format(self.server.server_port)
+
+        self.directory = tempfile.TemporaryDirectory()
+        settings = override_settings(THUMBNAILS_ROOT=self.directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        category = Categories.objects.create(category_name="Pâte à tartiner")
+        self.product = Products.objects.create(
+            id_product=1,
+            product_name="nutella",
+            img=self.base_url + "/product.jpg",
+            category=category,
+            nutriscore="e"
+            )
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def url(self, size="card", extension="webp"):
+        return thumbnails.thumbnail_url(1, self.product.img, size, extension)
+
+    def test_render_thumbnails(self):
+        rendered = thumbnails.render_thumbnails(IMAGE)
+        self.assertEqual(len(rendered), len(thumbnails.SIZES) * len(thumbnails.FORMATS))
+        for (size, extension), data in rendered.items():
+            image = thumbnails.Image.open(io.BytesIO(data))
+            self.assertEqual(image.size, thumbnails.SIZES[size])
+            self.assertEqual(image.format, thumbnails.FORMATS[extension][0])
+
+    def test_fetch_image_is_bounded(self):
+        with self.assertRaises(ValueError):
+            thumbnails.fetch_image(requests.Session(), self.product.img, max_bytes=100)
+
+    def test_build_thumbnails(self):
+        products = [(1, self.product.img), (2, self.base_url + "/missing.jpg")]
+        self.assertEqual(thumbnails.build_thumbnails(products, workers=2), (1, 1))
+        self.assertTrue(thumbnails.has_thumbnails(1, self.product.img))
+
+        # done and failed images are not fetched again
+        requests_made = self.server.requests
+        self.assertEqual(thumbnails.build_thumbnails(products), (0, 1))
+        self.assertEqual(self.server.requests, requests_made)
+
+    def test_view_makes_thumbnail_on_first_request(self):
+        response = self.client.get(self.url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/webp")
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertEqual(self.server.requests, 1)
+
+        response = self.client.get(self.url("saved", "jpg"))
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        image = thumbnails.Image.open(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual(image.size, thumbnails.SIZES["saved"])
+        self.assertEqual(self.server.requests, 1)
+
+    def test_view_redirects_changed_image(self):
+        url = self.url()
+        Products.objects.filter(pk=1).update(img=self.base_url + "/product.jpg?v=2")
+        response = self.client.get(url)
+        self.assertRedirects(
+            response,
+            thumbnails.thumbnail_url(1, self.base_url + "/product.jpg?v=2", "card", "webp"),
+            fetch_redirect_response=False
+            )
+
+    def test_view_falls_back_to_upstream_image(self):
+        Products.objects.filter(pk=1).update(img=self.base_url + "/missing.jpg")
+        self.product.refresh_from_db()
+        response = self.client.get(self.url())
+        self.assertRedirects(response, self.product.img, fetch_redirect_response=False)
+
+    def test_view_falls_back_on_huge_images(self):
+        for path in ("/bomb.png", "/huge.png"):
+            Products.objects.filter(pk=1).update(img=self.base_url + path)
+            self.product.refresh_from_db()
+            response = self.client.get(self.url())
+            self.assertRedirects(response, self.product.img, fetch_redirect_response=False)
+
+            # the failure is cached, the image is not fetched again
+            requests_made = self.server.requests
+            self.client.get(self.url())
+            self.assertEqual(self.server.requests, requests_made)
+
+    def test_view_falls_back_without_encoder(self):
+        # Pillow raises KeyError for a format it cannot save
+        formats = dict(thumbnails.FORMATS, webp=("NOSUCHFORMAT", "image/webp"))
+        with mock.patch.object(thumbnails, 'FORMATS', formats):
+            response = self.client.get(self.url())
+        self.assertRedirects(response, self.product.img, fetch_redirect_response=False)
+
+    def test_disabled_without_webp(self):
+        with mock.patch.object(thumbnails.features, 'check', return_value=False):
+            self.assertFalse(thumbnails.enabled())
+            response = self.client.get(self.url())
+        self.assertRedirects(response, self.product.img, fetch_redirect_response=False)
+        self.assertEqual(self.server.requests, 0)
+
+    def test_product_image_tag(self):
+        html = Template('{% load thumbnails %}{% product_image product "card" %}').render(
+            Context({"product": self.product})
+            )
+        self.assertIn('srcset="{}"'.format(self.url()), html)
+        self.assertIn('src="{}"'.format(self.url("card", "jpg")), html)
+        self.assertIn('width="300" height="250"', html)
+
+    def test_import_thumbnails(self):
+        com = Command(stdout=StringIO(), stderr=StringIO())
+        com.handle(dump=os.devnull, thumbnails=True)
+        self.assertIn("Thumbnails of 1 products made, 0 failed.", com.stdout.getvalue())
+        self.assertTrue(thumbnails.has_thumbnails(1, self.product.img))
@@ -1,28 +1,31 @@
-from django.test import TestCase, Client
+from django.core.cache import cache
 from django.urls import reverse
 from openfoodfacts.models import Products, Categories, Substitutes, User
 from openfoodfacts.forms import UserCreationForm
+from openfoodfacts.pagination import NEXT, encode_cursor
+from openfoodfacts.substitutes import rebuild_substitutes
+from openfoodfacts.tests.query_guard import QueryGuardTestCase
 
 
-class IndexPageTestCase(TestCase):
+class IndexPageTestCase(QueryGuardTestCase):
     def test_index_page(self):
         response = self.client.get(reverse('index'))
         self.assertEqual(response.status_code, 200)
 
 
-class LegalsPageTestCase(TestCase):
+class LegalsPageTestCase(QueryGuardTestCase):
     def test_legals_page(self):
         response = self.client.get(reverse('openfoodfacts:legals'))
         self.assertEqual(response.status_code, 200)
 
 
-class ContactsPageTestCase(TestCase):
+class ContactsPageTestCase(QueryGuardTestCase):
     def test_contacts_page(self):
         response = self.client.get(reverse('openfoodfacts:contacts'))
         self.assertEqual(response.status_code, 200)
 
 
-class DetailPageTestCase(TestCase):
+class DetailPageTestCase(QueryGuardTestCase):
     def setUp(self):
         category = Categories.objects.create(category_name="Pâte à tartiner")
         Products.objects.create(
@@ -45,7 +48,7 @@ class DetailPageTestCase(TestCase):
         self.assertEqual(response.status_code, 404)
 
 
-class SearchPageTestCase(TestCase):
+class SearchPageTestCase(QueryGuardTestCase):
     def setUp(self):
         category = Categories.objects.create(category_name="Pâte à tartiner")
         Products.objects.create(
@@ -61,13 +64,14 @@ class SearchPageTestCase(TestCase):
             category=category,
             nutriscore="a"
             )
+        rebuild_substitutes()
         self.password = "1234abcd"
         self.user = User.objects.create_user(
             username="david",
             password=self.password,
             email="email@email.com"
             )
-        self.client = Client()
+        self.client = self.client_class()
         self.origin = Products.objects.get(pk=1)
         self.replacement = Products.objects.get(pk=2)
         self.client.force_login(user=self.user)
@@ -86,8 +90,99 @@ class SearchPageTestCase(TestCase):
             })
         self.assertTrue(Substitutes.objects.exists())
 
+    def test_search_replace_product_twice(self):
+        url = reverse('openfoodfacts:search') + '?id_product=1'
+        for i in range(2):
+            self.client.post(url, {
+                "origin": self.origin.id_product,
+                "replacement": self.replacement.id_product,
+                })
+        self.assertEqual(Substitutes.objects.count(), 1)
+
+
+class SearchQueryCountTestCase(QueryGuardTestCase):
+    """The search page must cost the same number of queries whatever the category size."""
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="david",
+            password="1234abcd",
+            email="email@email.com"
+            )
+        self.client.force_login(user=self.user)
+
+    def create_category(self, name, size):
+        """Create a category with an origin product and `size` substitutes."""
+        category = Categories.objects.create(category_name=name)
+        origin = Products.objects.create(
+            id_product=size * 1000,
+            product_name="origin {}".format(name),
+            category=category,
+            nutriscore="e"
+            )
+        for i in range(1, size + 1):
+            replacement = Products.objects.create(
+                id_product=size * 1000 + i,
+                product_name="{} {}".format(name, i),
+                category=category,
+                nutriscore="a"
+                )
+            # the user already saved half of the substitutes
+            if i % 2:
+                Substitutes.objects.create(
+                    origin=origin,
+                    replacement=replacement,
+                    user=self.user
+                    )
+        rebuild_substitutes([category.pk])
+        return origin
+
+    def test_search_query_count_is_constant(self):
+        for size in (2, 20, 200):
+            origin = self.create_category("category {}".format(size), size)
+            # session, user, origin product, total and page of substitutes
+            with self.assertNumQueries(5):
+                response = self.client.get(
+                    reverse('openfoodfacts:search'),
+                    {"id_product": origin.id_product}
+                    )
+            self.assertEqual(response.status_code, 200)
+
+    def test_deep_search_pages_cost_the_same(self):
+        origin = self.create_category("biscuits", 100)
+        url = reverse('openfoodfacts:search')
+        response = self.client.get(url, {"id_product": origin.id_product})
+        pages = 1
+        while response.context['products'].has_next():
+            cursor = response.context['products'].next_cursor
+            # session, user, origin product and page of substitutes
+            with self.assertNumQueries(4):
+                response = self.client.get(
+                    url, {"id_product": origin.id_product, "cursor": cursor}
+                    )
+            pages += 1
+        # 90 substitutes are ranked, 45 are left once the saved ones are excluded
+        self.assertEqual(pages, 5)
+
+    def test_search_cursor_of_another_key_type_shows_first_page(self):
+        origin = self.create_category("biscuits", 20)
+        response = self.client.get(
+            reverse('openfoodfacts:search'),
+            {"id_product": origin.id_product, "cursor": encode_cursor(NEXT, "abc")}
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['products'].has_previous())
 
-class RegisterTestPageCase(TestCase):
+    def test_search_excludes_saved_substitutes(self):
+        origin = self.create_category("fromages", 4)
+        response = self.client.get(
+            reverse('openfoodfacts:search'),
+            {"id_product": origin.id_product}
+            )
+        displayed = [p.id_product for p in response.context['products']]
+        self.assertEqual(sorted(displayed), [4002, 4004])
+
+
+class RegisterTestPageCase(QueryGuardTestCase):
     def setUp(self):
         url = reverse('openfoodfacts:sign_up')
         data = {
@@ -127,7 +222,7 @@ class RegisterTestPageCase(TestCase):
         self.assertTrue(user.is_authenticated)
 
 
-class InvalidSignUpTests(TestCase):
+class InvalidSignUpTests(QueryGuardTestCase):
     def setUp(self):
         url = reverse('openfoodfacts:sign_up')
         self.response = self.client.post(url, {})  # submit an empty dictionary
@@ -146,7 +241,7 @@ class InvalidSignUpTests(TestCase):
         self.assertFalse(User.objects.exists())
 
 
-class LoginTestPageCase(TestCase):
+class LoginTestPageCase(QueryGuardTestCase):
     def setUp(self):
         self.username = "test"
         self.password = hash("1234abcd")
@@ -182,7 +277,7 @@ class LoginTestPageCase(TestCase):
         self.assertContains(response, 'csrfmiddlewaretoken')
 
 
-class AccountTestPageCase(TestCase):
+class AccountTestPageCase(QueryGuardTestCase):
     def setUp(self):
         url = reverse('openfoodfacts:account')
         self.data = {
@@ -203,7 +298,7 @@ class AccountTestPageCase(TestCase):
         self.assertEqual(response.status_code, 302)
 
 
-class TestPageCase(TestCase):
+class TestPageCase(QueryGuardTestCase):
     def setUp(self):
         url = reverse('openfoodfacts:saved')
         self.data = {
@@ -254,8 +349,66 @@ class TestPageCase(TestCase):
         self.assertFalse(Substitutes.objects.exists())
 
 
-class testPoductsListView(TestCase):
+class SavedQueryCountTestCase(QueryGuardTestCase):
+    """The saved page must cost the same number of queries whatever it shows."""
+    def setUp(self):
+        self.user = User.objects.create_user(username="john", password="abcdef123456")
+        self.client.force_login(user=self.user)
+        category = Categories.objects.create(category_name="Pâte à tartiner")
+        self.origin = Products.objects.create(
+            id_product=1,
+            product_name="nutella",
+            category=category
+            )
+        self.replacements = [
+            Products.objects.create(
+                id_product=i,
+                product_name="pâte {}".format(i),
+                category=category
+                )
+            for i in range(2, 7)
+            ]
+
+    def save(self, replacement):
+        Substitutes.objects.create(
+            origin=self.origin,
+            replacement=replacement,
+            user=self.user
+            )
+
+    def test_saved_query_count_is_constant(self):
+        for replacement in self.replacements:
+            self.save(replacement)
+            # session, user and page of substitutes with their products
+            with self.assertNumQueries(3):
+                response = self.client.get(reverse('openfoodfacts:saved'))
+            self.assertContains(response, replacement.product_name)
+
+    def test_saved_cursor_of_another_key_type_shows_first_page(self):
+        self.save(self.replacements[0])
+        response = self.client.get(
+            reverse('openfoodfacts:saved'), {"cursor": encode_cursor(NEXT, "abc")}
+            )
+        self.assertContains(response, self.replacements[0].product_name)
+
+    def test_delete_is_a_single_query(self):
+        self.save(self.replacements[0])
+        self.save(self.replacements[1])
+        # session, user, delete and page of substitutes
+        with self.assertNumQueries(4):
+            self.client.post(reverse('openfoodfacts:saved'), {
+                "origin": self.origin.id_product,
+                "replacement": self.replacements[0].id_product,
+                })
+        self.assertEqual(
+            list(Substitutes.objects.values_list('replacement', flat=True)),
+            [self.replacements[1].id_product]
+            )
+
+
+class testPoductsListView(QueryGuardTestCase):
     def setUp(self):
+        cache.clear()
         self.url = reverse('openfoodfacts:products_list')
         category = Categories.objects.create(category_name="Pâte à tartiner")
 
@@ -273,3 +426,84 @@ class testPoductsListView(TestCase):
     def test_product_list_page_returns_404(self):
         response = self.client.get(self.url, {"query": "Fromages"})
         self.assertTrue(response, 404)
+
+
+class ProductSearchTestCase(QueryGuardTestCase):
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('openfoodfacts:products_list')
+        category = Categories.objects.create(category_name="Pâte à tartiner")
+
+        Products.objects.create(
+            id_product=1,
+            product_name="Nutella",
+            category=category,
+            nutriscore="e"
+            )
+        Products.objects.create(
+            id_product=2,
+            product_name="Pâte à tartiner aux noisettes",
+            category=category,
+            nutriscore="d"
+            )
+
+    def search(self, query):
+        response = self.client.get(self.url, {"query": query})
+        if response.status_code == 404:
+            return []
+        return [p.product_name for p in response.context['products_list']]
+
+    def test_search_matches_word_prefix(self):
+        self.assertEqual(self.search("nutel"), ["Nutella"])
+
+    def test_search_excludes_unrelated_products(self):
+        self.assertEqual(self.search("noisettes"), ["Pâte à tartiner aux noisettes"])
+        self.assertEqual(self.search("fromage"), [])
+
+    def test_search_follows_renamed_products(self):
+        Products.objects.filter(pk=1).update(product_name="Nocciolata")
+        self.assertEqual(self.search("nutella"), [])
+        self.assertEqual(self.search("nocciolata"), ["Nocciolata"])
+
+
+class ProductsListPaginationTestCase(QueryGuardTestCase):
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('openfoodfacts:products_list')
+        self.user = User.objects.create_user(username="david", password="purbeurre")
+        self.client.force_login(user=self.user)
+        self.spreads = Categories.objects.create(category_name="en:spreads")
+        self.biscuits = Categories.objects.create(category_name="en:biscuits")
+        for i in range(12):
+            Products.objects.create(
+                id_product=i,
+                product_name="Nutella {}".format(i),
+                category=self.spreads if i < 10 else self.biscuits,
+                nutriscore="e"
+                )
+
+    def test_categories_are_counted(self):
+        response = self.client.get(self.url, {"query": "nutella"})
+        self.assertEqual(
+            [(category.pk, count) for category, count in response.context['categories']],
+            [(self.spreads.pk, 10), (self.biscuits.pk, 2)]
+            )
+        self.assertEqual(len(response.context['products_list']), 9)
+        self.assertEqual(response.context['paginator'].num_pages, 2)
+
+    def test_category_filter(self):
+        response = self.client.get(self.url, {"query": "nutella", "category": self.biscuits.pk})
+        self.assertEqual(
+            {p.category_id for p in response.context['products_list']},
+            {self.biscuits.pk}
+            )
+        self.assertFalse(response.context['is_paginated'])
+
+    def test_query_count(self):
+        # session, user, categories, the page and the catalogue version
+        with self.assertNumQueries(5):
+            self.client.get(self.url, {"query": "nutella", "page": 2})
+
+    def test_missing_query_redirects(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
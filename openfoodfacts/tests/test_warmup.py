@@ -0,0 +1,19 @@
+from django.test import TransactionTestCase
+
+from openfoodfacts.autocomplete import product_names
+from openfoodfacts.models import Categories, Products
+from openfoodfacts.warmup import warm_up
+
+
+class WarmUpTestCase(TransactionTestCase):
+    def setUp(self):
+        product_names._index = None
+        category = Categories.objects.create(category_name="Pâte à tartiner")
+        Products.objects.create(id_product=1, product_name="Nutella", category=category)
+
+    def tearDown(self):
+        product_names._index = None
+
+    def test_warm_up(self):
+        warm_up()
+        self.assertEqual(product_names._index.search("nut")[0]["id_product"], 1)
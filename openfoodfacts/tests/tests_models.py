@@ -1,5 +1,6 @@
+from django.db import IntegrityError, connection, transaction
 from django.test import TestCase
-from openfoodfacts.models import Categories, Products
+from openfoodfacts.models import Categories, Products, Substitutes, User
 
 
 class CategoriesTestCase(TestCase):
@@ -49,3 +50,53 @@ class ProductsTestCase(TestCase):
         nutella = Products.objects.get(product_name="nutella")
         cat = Categories.objects.get(category_name="Pâtes à tartiner")
         self.assertEqual(str(nutella.category), cat.category_name)
+
+
+class IndexesTestCase(TestCase):
+    """The hot queries of the search and saved views must use an index."""
+    def setUp(self):
+        self.user = User.objects.create_user(username="david", password="1234abcd")
+        category = Categories.objects.create(category_name="Pâtes à tartiner")
+        for i in range(1, 4):
+            Products.objects.create(
+                id_product=i,
+                product_name="product {}".format(i),
+                category=category,
+                nutriscore="abc"[i - 1]
+                )
+
+    def explain(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # tables are tiny, make the planner use any usable index
+                cursor.execute("SET LOCAL enable_seqscan = off")
+                cursor.execute("EXPLAIN " + sql, params)
+            else:
+                cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            return "\n".join(str(row) for row in cursor.fetchall())
+
+    def unique_index(self):
+        """Name of the (user, origin, replacement) unique index of Substitutes."""
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, Substitutes._meta.db_table
+                )
+        for name, constraint in constraints.items():
+            if constraint['columns'] == ['user_id', 'origin_id', 'replacement_id']:
+                return name
+
+    def test_products_category_nutriscore_index(self):
+        queryset = Products.objects.filter(category_id=1, nutriscore__lte="b")
+        self.assertIn("products_category_nutri_idx", self.explain(queryset))
+
+    def test_substitutes_user_origin_index(self):
+        queryset = Substitutes.objects.filter(user=self.user, origin=1)
+        self.assertIn(self.unique_index(), self.explain(queryset))
+
+    def test_substitutes_are_unique(self):
+        origin, replacement = Products.objects.get(pk=3), Products.objects.get(pk=1)
+        Substitutes.objects.create(origin=origin, replacement=replacement, user=self.user)
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Substitutes.objects.create(origin=origin, replacement=replacement, user=self.user)
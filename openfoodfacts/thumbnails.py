@@ -0,0 +1,190 @@
+"""
+Local thumbnails of the product images.
+
+The product cards show the OpenFoodFacts image of each product at a fixed
+size. Each image is fetched once, after an import with
+`api_off --thumbnails` or on the first request of one of its thumbnails,
+resized to the sizes of the templates and stored under THUMBNAILS_ROOT in
+WebP and JPEG. The name of a thumbnail holds a hash of the image URL, so
+thumbnails are served as immutable and a new upstream image gets new URLs.
+
+Pillow is optional: without it, or when it is built without WebP, the
+templates keep the upstream images.
+"""
+import hashlib
+import io
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from django.conf import settings
+from django.core.cache import cache
+from django.urls import reverse
+
+try:
+    from PIL import Image, features
+except ImportError:
+    Image = None
+
+# Sizes of the images in the templates, (width, height)
+SIZES = {
+    "card": (300, 250),
+    "saved": (200, 200),
+}
+
+# Extension: Pillow format and content type
+FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpg": ("JPEG", "image/jpeg"),
+}
+
+QUALITY = 80
+BACKGROUND = (255, 255, 255)
+
+# Upstream images bigger than this are not thumbnailed
+MAX_BYTES = 5 * 1024 * 1024
+# nor images of more pixels, a small file can decode to gigabytes
+MAX_PIXELS = 5000 * 5000
+TIMEOUT = 5
+
+# A failed fetch is not retried by the view before this delay, in seconds
+RETRY_AFTER = 60 * 60
+
+# Keep-alive connections to the image host, shared by the threads
+session = requests.Session()
+
+
+def enabled():
+    """Pillow is installed and encodes every format of FORMATS."""
+    return Image is not None and features.check('webp')
+
+
+def root():
+    return getattr(
+        settings, 'THUMBNAILS_ROOT', os.path.join(settings.BASE_DIR, 'thumbnails')
+        )
+
+
+def image_hash(url):
+    """Short hash of an image URL, part of the name of its thumbnails."""
+    return hashlib.sha1(url.encode()).hexdigest()[:10]
+
+
+def thumbnail_path(id_product, digest, size, extension):
+    return os.path.join(root(), size, "{}-{}.{}".format(id_product, digest, extension))
+
+
+def thumbnail_url(id_product, url, size, extension):
+    return reverse('openfoodfacts:thumbnail', kwargs={
+        'id_product': id_product,
+        'size': size,
+        'digest': image_hash(url),
+        'extension': extension,
+        })
+
+
+def has_thumbnails(id_product, url):
+    digest = image_hash(url)
+    return all(
+        os.path.exists(thumbnail_path(id_product, digest, size, extension))
+        for size in SIZES for extension in FORMATS
+        )
+
+
+def fetch_image(http, url, timeout=TIMEOUT, max_bytes=MAX_BYTES):
+    """The bytes of an image, ValueError when it is bigger than `max_bytes`."""
+    with http.get(url, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        data = bytearray()
+        for chunk in response.iter_content(64 * 1024):
+            data.extend(chunk)
+            if len(data) > max_bytes:
+                raise ValueError("{} is bigger than {} bytes".format(url, max_bytes))
+    return bytes(data)
+
+
+def render_thumbnails(data):
+    """
+    Resize an image to each size, centered on a white background so that
+    the templates do not distort it. Return {(size, extension): bytes},
+    ValueError when the image has more than MAX_PIXELS pixels and KeyError
+    when Pillow has no encoder for one of the FORMATS.
+    """
+    image = Image.open(io.BytesIO(data))
+    if image.width * image.height > MAX_PIXELS:
+        raise ValueError("{}x{} image".format(image.width, image.height))
+    # let the JPEG decoder downscale the big images
+    image.draft('RGB', max(SIZES.values()))
+    image = image.convert('RGBA')
+
+    thumbnails = {}
+    for size, dimensions in SIZES.items():
+        resized = image.copy()
+        resized.thumbnail(dimensions, Image.LANCZOS)
+        canvas = Image.new('RGB', dimensions, BACKGROUND)
+        canvas.paste(resized, (
+            (dimensions[0] - resized.width) // 2,
+            (dimensions[1] - resized.height) // 2,
+            ), resized)
+        for extension, (image_format, content_type) in FORMATS.items():
+            output = io.BytesIO()
+            canvas.save(output, image_format, quality=QUALITY)
+            thumbnails[size, extension] = output.getvalue()
+    return thumbnails
+
+
+def store(path, data):
+    """Write a file atomically, concurrent requests may write the same one."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=directory)
+    with os.fdopen(descriptor, 'wb') as output:
+        output.write(data)
+    os.replace(temporary, path)
+
+
+def make_thumbnails(http, id_product, url, timeout=TIMEOUT, max_bytes=MAX_BYTES):
+    """Fetch the image of a product and store its thumbnails. Return success."""
+    failed_key = "thumbnail-failed-{}".format(image_hash(url))
+    if cache.get(failed_key):
+        return False
+    try:
+        thumbnails = render_thumbnails(fetch_image(http, url, timeout, max_bytes))
+    except (requests.RequestException, OSError, ValueError, KeyError,
+            Image.DecompressionBombError):
+        # unreachable, too big, not an image or not encodable
+        cache.set(failed_key, True, RETRY_AFTER)
+        return False
+
+    digest = image_hash(url)
+    for (size, extension), data in thumbnails.items():
+        store(thumbnail_path(id_product, digest, size, extension), data)
+    return True
+
+
+def build_thumbnails(products, http=session, workers=8, timeout=TIMEOUT):
+    """
+    Make the missing thumbnails of `products`, (id_product, url) pairs, with
+    `workers` concurrent fetches. Return the number of products done and
+    failed.
+    """
+    if not enabled():
+        return 0, 0
+    missing = (
+        (id_product, url) for id_product, url in products
+        if url and not has_thumbnails(id_product, url)
+        )
+
+    def make(product):
+        return make_thumbnails(http, product[0], product[1], timeout)
+
+    done = failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for success in executor.map(make, missing):
+            if success:
+                done += 1
+            else:
+                failed += 1
+    return done, failed
@@ -1,7 +1,7 @@
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.contrib.auth import views as auth_views
 
-from . import views
+from . import api, views
 
 urlpatterns = [
     path('search/', views.search, name='search'),
@@ -14,6 +14,16 @@ urlpatterns = [
     path('contacts/', views.contacts, name='contacts'),
     path('legals/', views.legals, name='legals'),
     path('saved/', views.saved, name='saved'),
+    re_path(
+        r'^thumbnails/(?P<size>card|saved)/(?P<id_product>[0-9]+)-(?P<digest>[0-9a-f]{10})\.(?P<extension>webp|jpg)$',
+        views.thumbnail,
+        name='thumbnail'
+        ),
+    path('autocomplete/', api.autocomplete, name='autocomplete'),
+    path('metrics/', api.metrics, name='metrics'),
+    path('api/products/', api.products, name='api_products'),
+    path('api/products/<int:id_product>/', api.product, name='api_product'),
+    path('api/products/<int:id_product>/substitutes/', api.substitutes, name='api_substitutes'),
     path('', include('django.contrib.auth.urls'))
 
 ]
@@ -1,19 +1,30 @@
+import os
+
 from django.shortcuts import render, get_object_or_404, redirect
-from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
-from django.http import Http404, JsonResponse
+from django.http import FileResponse, Http404
 from django.contrib.auth import login, authenticate, update_session_auth_hash
 from django.template.loader import render_to_string
 from django.contrib.auth.decorators import login_required
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import require_safe
 from django.views.generic import ListView
 from django.contrib.auth.forms import PasswordChangeForm
 from django.contrib import messages
+from django.db.models import Count
 
+from .cache import cache_anonymous
 from .forms import SignUpForm, EmailChangeForm
-from .models import Products, Substitutes, User
+from .models import Categories, Products, Substitutes, User
+from .nutrients import NUTRIENTS, level_field, level_image
+from .pagination import KeysetPaginator
+from .search import search_products
+from .substitutes import ranked_substitutes
+from . import thumbnails
 
 IMG = 'https://authentic-visit.jp/wp-content/uploads/2017/12/gregoire-jeanneau-1451361.jpg'
 
 
+@cache_anonymous
 def index(request):
     """Home page."""
     context = {
@@ -22,6 +33,7 @@ def index(request):
     return render(request, 'openfoodfacts/index.html', context)
 
 
+@cache_anonymous
 def search(request):
     """Return a list of products with a nutriscore at least equivalent of the product."""
     try:
@@ -30,21 +42,16 @@ def search(request):
     except Products.DoesNotExist:
         raise Http404
     else:
-        sub_list = Products.objects.filter(category=origin.category)
-        sub_list = sub_list.filter(nutriscore__lte=origin.nutriscore)
-        sub_list = sub_list.order_by('nutriscore')
-        sub_list = sub_list.exclude(pk=id_prod)
+        # substitutes ranked by api_off, see openfoodfacts.substitutes
+        sub_list = ranked_substitutes(origin.id_product)
 
         if request.user.is_authenticated:
             # Remove products already in the user list
-            for sub in sub_list:
-                listed = Substitutes.objects.filter(
-                    origin=id_prod,
-                    replacement=sub.id_product,
-                    user=request.user
-                    )
-                if listed:
-                    sub_list = sub_list.exclude(pk=sub.id_product)
+            listed = Substitutes.objects.filter(
+                origin=id_prod,
+                user=request.user
+                )
+            sub_list = sub_list.exclude(pk__in=listed.values('replacement'))
 
     # user want to save a product
     if request.method == 'POST':
@@ -54,23 +61,16 @@ def search(request):
         origin = Products.objects.get(pk=origin)
         replacement = Products.objects.get(pk=replacement)
 
-        Substitutes.objects.create(
+        Substitutes.objects.get_or_create(
             origin=origin,
             replacement=replacement,
             user=request.user
             )
         sub_list = sub_list.exclude(pk=replacement.id_product)
 
-    # Slices pages
-    paginator = Paginator(sub_list, 9)
-    page = request.GET.get('page')
-
-    try:
-        products = paginator.page(page)
-    except PageNotAnInteger:
-        products = paginator.page(1)
-    except EmptyPage:
-        products = paginator.page(paginator.num_pages)
+    # Slices pages following the rank of the substitutes
+    paginator = KeysetPaginator(sub_list, 9, key='rankings__rank', with_total=True)
+    products = paginator.page(request.GET.get('cursor'))
 
     context = {
         'products': products,
@@ -85,49 +85,17 @@ def search(request):
     return render(request, 'openfoodfacts/search.html', context)
 
 
+@cache_anonymous
 def detail(request, id_product):
     """ Detail the product with nutiscore, and nutrient quantity for 100g."""
     # if product doesn't exists raise error 404
     product = get_object_or_404(Products, pk=id_product)
 
-    fat_index_img = ""
-    saturated_fat_index_img = ""
-    salt_index_img = ""
-    sugar_index_img = ""
-    url = "https://static.openfoodfacts.org/images/misc/"
-
-    # Image based on the qantity of nutrients
-    if product.fat is not None:
-        if 0 <= product.fat < 3:
-            fat_index_img = url + "low_30.png"
-        elif 3 <= product.fat <= 20:
-            fat_index_img = url + "moderate_30.png"
-        else:
-            fat_index_img = url + "high_30.png"
-
-    if product.saturated_fat is not None:
-        if 0 <= product.saturated_fat < 1.5:
-            saturated_fat_index_img = url + "low_30.png"
-        elif 1.5 <= product.saturated_fat <= 5:
-            saturated_fat_index_img = url + "moderate_30.png"
-        else:
-            saturated_fat_index_img = url + "high_30.png"
-
-    if product.salt is not None:
-        if 0 <= product.salt < 0.3:
-            salt_index_img = url + "low_30.png"
-        elif 0.3 <= product.salt <= 1.5:
-            salt_index_img = url + "moderate_30.png"
-        else:
-            salt_index_img = url + "high_30.png"
-
-    if product.sugar is not None:
-        if 0 <= product.sugar < 5:
-            sugar_index_img = url + "low_30.png"
-        elif 5 <= product.sugar <= 12.5:
-            sugar_index_img = url + "moderate_30.png"
-        else:
-            sugar_index_img = url + "high_30.png"
+    # traffic lights computed by api_off, see openfoodfacts.nutrients
+    images = {
+        nutrient: level_image(getattr(product, level_field(nutrient)))
+        for nutrient in NUTRIENTS
+        }
 
     context = {
         "product": product.product_name,
@@ -137,16 +105,35 @@ def detail(request, id_product):
         "saturated_fat": product.saturated_fat,
         "salt": product.salt,
         "sugar": product.sugar,
-        "fat_index_img": fat_index_img,
-        "saturated_fat_index_img": saturated_fat_index_img,
-        "salt_index_img": salt_index_img,
-        "sugar_index_img": sugar_index_img,
+        "fat_index_img": images["fat"],
+        "saturated_fat_index_img": images["saturated_fat"],
+        "salt_index_img": images["salt"],
+        "sugar_index_img": images["sugar"],
         "redirection": product.url,
         "page_title": product.product_name
     }
     return render(request, 'openfoodfacts/detail.html', context)
 
 
+@require_safe
+def thumbnail(request, id_product, size, digest, extension):
+    """Serve a product thumbnail, made from the upstream image on first request."""
+    path = thumbnails.thumbnail_path(id_product, digest, size, extension)
+    if not os.path.exists(path):
+        product = get_object_or_404(Products.objects.only('img'), pk=id_product)
+        if thumbnails.image_hash(product.img) != digest:
+            # the image changed since the page was rendered
+            return redirect(thumbnails.thumbnail_url(id_product, product.img, size, extension))
+        if not thumbnails.enabled() or not thumbnails.make_thumbnails(
+                thumbnails.session, id_product, product.img):
+            return redirect(product.img)
+
+    response = FileResponse(open(path, 'rb'), content_type=thumbnails.FORMATS[extension][1])
+    # the name changes with the upstream image
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
 def sign_up(request):
     """Sign up view with buil in django form."""
     if request.method == 'POST':
@@ -182,6 +169,7 @@ def account(request):
     return render(request, 'openfoodfacts/account.html', context)
 
 
+@cache_anonymous
 def contacts(request):
     context = {
         "title": 'Contacts',
@@ -191,6 +179,7 @@ def contacts(request):
     return render(request, 'openfoodfacts/contacts.html', context)
 
 
+@cache_anonymous
 def legals(request):
 
     context = {
@@ -208,31 +197,21 @@ def saved(request):
     User can delete a product by using POST request.
     """
 
-    products_saved = Substitutes.objects.filter(user=request.user)
+    products_saved = Substitutes.objects.filter(
+        user=request.user
+        ).select_related('origin', 'replacement')
 
     if request.method == 'POST':
-        origin = request.POST.get('origin')
-        replacement = request.POST.get('replacement')
-
-        origin = Products.objects.get(pk=origin)
-        replacement = Products.objects.get(pk=replacement)
-
-        Substitutes.objects.get(
-            origin=origin,
-            replacement=replacement,
+        # a single DELETE ... WHERE, Substitutes has no dependent rows
+        Substitutes.objects.filter(
+            origin_id=request.POST.get('origin'),
+            replacement_id=request.POST.get('replacement'),
             user=request.user
             ).delete()
 
-    # Slices pages
-    paginator = Paginator(products_saved, 5)
-    page = request.GET.get('page')
-
-    try:
-        products_saved = paginator.page(page)
-    except PageNotAnInteger:
-        products_saved = paginator.page(1)
-    except EmptyPage:
-        products_saved = paginator.page(paginator.num_pages)
+    # Slices pages in the order of the saves
+    paginator = KeysetPaginator(products_saved, 5)
+    products_saved = paginator.page(request.GET.get('cursor'))
 
     context = {
         "title": "Vos aliments sauvegardés",
@@ -244,40 +223,50 @@ def saved(request):
     return render(request, 'openfoodfacts/saved.html', context)
 
 
+@method_decorator(cache_anonymous, name='dispatch')
 class ProductsListView(ListView):
     """Return a product list based on the product name and matching query."""
     model = Products
+    paginate_by = 9
 
-    def get_queryset(self):
+    def get(self, request, *args, **kwargs):
         """Get the query parameter."""
-        self.query = self.request.GET.get('query')
+        self.query = request.GET.get('query')
 
         if not self.query:
             return redirect(index)
+        return super(ProductsListView, self).get(request, *args, **kwargs)
 
-        # query match product_name
-        queryset = Products.objects.filter(
-            product_name__iexact=self.query
-            )
-
-        # query doesn't match exactly but can match product_name
-        queryset = Products.objects.filter(
-            product_name__icontains=self.query
-            )
-
-        # filter distinct categories in the queryset
-        categories = queryset.distinct('category')
-        self.categories = {}
-        # keep the last category
-        for category in categories:
-            c = "".join(
-                str(category.category).split(',')[-1:]).replace('[', '').replace('\'', '').replace(']', '')
-            self.categories[category] = c
-        queryset = queryset.order_by('nutriscore')
-        if not queryset:
+    def get_queryset(self):
+        # products matching the query, best match first
+        queryset = search_products(self.query)
+
+        # one row per category with its number of matching products
+        counts = queryset.order_by().values(
+            'category', 'category__category_name'
+            ).annotate(count=Count('pk')).order_by('-count', 'category__category_name')
+        self.categories = [
+            (Categories(pk=row['category'], category_name=row['category__category_name']), row['count'])
+            for row in counts
+            ]
+        if not self.categories:
             raise Http404
-        else:
-            return queryset
+
+        # a category tab only lists the products of its category
+        self.category = None
+        self.count = sum(count for category, count in self.categories)
+        selected = self.request.GET.get('category')
+        for category, count in self.categories:
+            if str(category.pk) == selected:
+                self.category, self.count = category, count
+                queryset = queryset.filter(category=category)
+        return queryset
+
+    def get_paginator(self, *args, **kwargs):
+        paginator = super(ProductsListView, self).get_paginator(*args, **kwargs)
+        # already counted with the categories
+        paginator.count = self.count
+        return paginator
 
     def get_context_data(self, **kwargs):
         """Contains essential data for the page."""
@@ -287,4 +276,5 @@ class ProductsListView(ListView):
         data['img'] = IMG
         data['query'] = self.query
         data['categories'] = self.categories
+        data['category'] = self.category
         return data
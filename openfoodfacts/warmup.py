@@ -0,0 +1,45 @@
+"""
+Warm-up of a new server process, called by the gunicorn hooks of
+purbeurre_project/gunicorn_conf.py.
+
+The URL patterns, the templates and the autocomplete index are loaded
+before the first request instead of during it. When gunicorn preloads the
+application this runs once in the master, and the workers share the
+loaded objects copy-on-write.
+"""
+import logging
+import time
+
+from django.db import DatabaseError, connections
+from django.template.loader import get_template
+from django.urls import reverse
+
+from .autocomplete import product_names
+
+logger = logging.getLogger(__name__)
+
+TEMPLATES = [
+    'openfoodfacts/index.html',
+    'openfoodfacts/products_list.html',
+    'openfoodfacts/search.html',
+    'openfoodfacts/detail.html',
+    'openfoodfacts/saved.html',
+    'openfoodfacts/product_card.html',
+    'openfoodfacts/product_image.html',
+]
+
+
+def warm_up():
+    start = time.perf_counter()
+    # the first reverse() loads the URL patterns
+    reverse('index')
+    for name in TEMPLATES:
+        get_template(name)
+    try:
+        product_names.index()
+    except DatabaseError:
+        logger.warning("Autocomplete index not built, database unavailable.", exc_info=True)
+    finally:
+        # a connection opened before the fork would be shared by the workers
+        connections.close_all()
+    logger.info("Warmed up in %.2fs", time.perf_counter() - start)
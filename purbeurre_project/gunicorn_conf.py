@@ -0,0 +1,71 @@
+"""
+Gunicorn settings of PurBeurre, used by the Procfile:
+
+    gunicorn -c purbeurre_project/gunicorn_conf.py purbeurre_project.wsgi
+
+Each setting can be changed from the environment. See the README for the
+measured throughput and latency of each worker class.
+"""
+import multiprocessing
+import os
+
+
+def cpu_count():
+    """CPUs this process may run on, fewer than the host's in a container."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # macOS
+        return multiprocessing.cpu_count()
+
+
+bind = "0.0.0.0:{}".format(os.environ.get("PORT", "8000"))
+
+# sync, gthread or gevent (gevent must be installed). gthread serves more
+# concurrent requests than sync with fewer processes, it is not faster.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+
+# Heroku sets WEB_CONCURRENCY from the memory of the dyno
+workers = int(os.environ.get(
+    "WEB_CONCURRENCY",
+    cpu_count() * 2 + 1 if worker_class == "sync" else cpu_count() + 1
+    ))
+threads = int(os.environ.get("GUNICORN_THREADS", 4 if worker_class == "gthread" else 1))
+# concurrent requests of a gevent worker
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 100))
+
+# The master imports Django once and the workers share its memory. gevent
+# has to patch the standard library before Django is imported, so its
+# workers load the application themselves.
+preload_app = os.environ.get(
+    "GUNICORN_PRELOAD", "0" if worker_class == "gevent" else "1"
+    ) == "1"
+
+# Workers are recycled so that their memory growth is reclaimed, at
+# different times thanks to the jitter.
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 100))
+
+# The Heroku router drops a request after 30 seconds
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 20))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+
+# Heartbeat files of the workers in memory rather than on disk
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+
+# an empty GUNICORN_ACCESSLOG disables the access log
+accesslog = os.environ.get("GUNICORN_ACCESSLOG", "-") or None
+errorlog = "-"
+
+
+def when_ready(server):
+    if preload_app:
+        from openfoodfacts.warmup import warm_up
+        warm_up()
+
+
+def post_worker_init(worker):
+    if not preload_app:
+        from openfoodfacts.warmup import warm_up
+        warm_up()
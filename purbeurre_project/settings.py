@@ -42,11 +42,12 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'debug_toolbar',
     'openfoodfacts.apps.OpenfoodfactsConfig',
 ]
 
 MIDDLEWARE = [
+    'openfoodfacts.metrics.RequestMetricsMiddleware',
+    'openfoodfacts.cache.AnonymousCacheMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,10 +55,18 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
 ]
 
+# Django debug toolbar, never in production
+if DEBUG:
+    INSTALLED_APPS.append('debug_toolbar')
+    # outside of the page cache, which must not store the toolbar
+    MIDDLEWARE.insert(
+        MIDDLEWARE.index('openfoodfacts.cache.AnonymousCacheMiddleware'),
+        'debug_toolbar.middleware.DebugToolbarMiddleware'
+    )
+
 ROOT_URLCONF = 'purbeurre_project.urls'
 
 TEMPLATES = [
@@ -71,6 +80,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'openfoodfacts.context_processors.catalogue',
             ],
         },
     },
@@ -93,6 +103,68 @@ DATABASES = {
     }
 }
 
+# DATABASE_URL, set by Heroku, replaces the local database
+DATABASES['default'].update(dj_database_url.config())
+
+# Connections are kept CONN_MAX_AGE seconds, 0 closes them after each
+# request. Reused connections idle for more than DATABASE_HEALTH_CHECK_IDLE
+# seconds are checked first, see openfoodfacts.db.
+DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('CONN_MAX_AGE', 500))
+DATABASE_HEALTH_CHECK_IDLE = int(os.environ.get('DATABASE_HEALTH_CHECK_IDLE', 30))
+
+# DATABASE_POOLER=pgbouncer when DATABASE_URL points to a pgbouncer in
+# transaction pooling mode: consecutive transactions may run on different
+# server connections, so QuerySet.iterator() cannot keep a server-side
+# cursor open between them.
+if os.environ.get('DATABASE_POOLER') == 'pgbouncer':
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+
+
+# Cache of the pages served to anonymous visitors, see openfoodfacts.cache
+# CACHE_BACKEND and CACHE_LOCATION select another backend, e.g. memcached.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'purbeurre'),
+    }
+}
+
+# Cached pages are shared by the workers of a dyno
+if os.environ.get('ENV') == 'PRODUCTION' and 'CACHE_BACKEND' not in os.environ:
+    CACHES['default'].update({
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CACHE_LOCATION', '/tmp/purbeurre-cache'),
+    })
+
+PURBEURRE_CACHE_TIMEOUT = int(os.environ.get('CACHE_TIMEOUT', 60 * 60 * 24))
+
+# Caches shared by every worker and every dyno
+SHARED_CACHE_BACKENDS = (
+    'django.core.cache.backends.db.DatabaseCache',
+    'django.core.cache.backends.memcached.MemcachedCache',
+    'django.core.cache.backends.memcached.PyLibMCCache',
+    'django_redis.cache.RedisCache',
+)
+
+# Sessions are read from the cache and written through to the database,
+# SESSION_ENGINE=django.contrib.sessions.backends.signed_cookies keeps them
+# in the browser instead. Expired rows are removed by `manage.py clearsessions`.
+SESSION_ENGINE = os.environ.get('SESSION_ENGINE', 'django.contrib.sessions.backends.cached_db')
+
+# Users of the sessions are cached too, see openfoodfacts.backends
+AUTHENTICATION_BACKENDS = ['openfoodfacts.backends.CachedModelBackend']
+USER_CACHE_TIMEOUT = int(os.environ.get('USER_CACHE_TIMEOUT', 60 * 15))
+
+# A logout or a password change only evicts the cache of the process which
+# handled it: sessions and users stay in the database with a local cache.
+if CACHES['default']['BACKEND'] not in SHARED_CACHE_BACKENDS:
+    if SESSION_ENGINE in ('django.contrib.sessions.backends.cache',
+                          'django.contrib.sessions.backends.cached_db'):
+        SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+    AUTHENTICATION_BACKENDS = ['django.contrib.auth.backends.ModelBackend']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
@@ -132,9 +204,38 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Thumbnails of the product images, see openfoodfacts.thumbnails
+THUMBNAILS_ROOT = os.environ.get('THUMBNAILS_ROOT', os.path.join(BASE_DIR, 'thumbnails'))
+
 # Django debug toolbar
 INTERNAL_IPS = ['127.0.0.1']
 
+# Request metrics, see openfoodfacts.metrics
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 1 if DEBUG else 0.1))
+METRICS_LOG_INTERVAL = int(os.environ.get('METRICS_LOG_INTERVAL', 60))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'openfoodfacts.metrics': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'openfoodfacts.warmup': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 LOGIN_REDIRECT_URL = '/openfoodfacts/account'
 LOGIN_URL = '/openfoodfacts/login'
 
@@ -153,5 +254,3 @@ if os.environ.get('ENV') == 'PRODUCTION':
     # https://warehouse.python.org/project/whitenoise/
     STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
-    db_from_env = dj_database_url.config(conn_max_age=500)
-    DATABASES['default'].update(db_from_env)